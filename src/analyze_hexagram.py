@@ -53,7 +53,7 @@ def analyze_image(image_path, config_path='config/config.yaml'):
             cv2.imwrite(str(region_path), region)
             
             logger.info(f"开始分析区域: {region_path}")
-            analysis_result = image_captioner.analyze_hexagram(str(region_path))
+            analysis_result = image_captioner.analyze_hexagram(region)
             
             # 输出结果
             print(f"区域 {i} 分析结果:\n{analysis_result}")
@@ -0,0 +1,481 @@
+import argparse
+import json
+import logging
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    return logging.getLogger(__name__)
+
+def edit_distance(a: str, b: str) -> int:
+    """计算两个字符串的编辑距离"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb)
+            ))
+        previous = current
+    return previous[-1]
+
+def normalize_text(text: str) -> str:
+    """去除空白字符，避免OCR插入的空格影响字符错误率"""
+    return ''.join(text.split())
+
+def load_fixtures(fixture_dir):
+    """加载测试集：每张图片对应一个同名的 .txt 参考文本"""
+    fixtures = []
+    for image_path in sorted(Path(fixture_dir).glob('*.png')):
+        reference_path = image_path.with_suffix('.txt')
+        if reference_path.exists():
+            fixtures.append((image_path, reference_path.read_text(encoding='utf-8')))
+    if not fixtures:
+        raise FileNotFoundError(f"测试集中没有找到图片与参考文本: {fixture_dir}")
+    return fixtures
+
+# 预处理方案，字段含义与配置文件中 pdf_processing.preprocessing 相同
+PREPROCESS_PROFILES = {
+    'nlmeans': {'enable': True, 'denoise': True, 'denoise_method': 'nlmeans', 'enhance_contrast': False, 'binarize': 'otsu'},
+    'median': {'enable': True, 'denoise': True, 'denoise_method': 'median', 'enhance_contrast': False, 'binarize': 'otsu'},
+    'median_auto': {'enable': True, 'denoise': True, 'denoise_method': 'median', 'noise_threshold': 2.0, 'enhance_contrast': False, 'binarize': 'otsu'},
+    'adaptive': {'enable': True, 'denoise': False, 'enhance_contrast': False, 'binarize': 'adaptive'},
+    'clahe_otsu': {'enable': True, 'denoise': False, 'enhance_contrast': True, 'binarize': 'otsu'},
+    'none': {'enable': False},
+}
+
+def benchmark_preprocess(args):
+    """比较各预处理方案的每步耗时和OCR字符错误率"""
+    from PIL import Image
+    from pdf_processor import PDFProcessor
+
+    processor = PDFProcessor(args.config)
+    fixtures = load_fixtures(args.fixtures)
+
+    profiles = {'config': processor.config['pdf_processing'].get('preprocessing', {})}
+    profiles.update(PREPROCESS_PROFILES)
+
+    print(f"测试集: {len(fixtures)} 页")
+    print(f"{'方案':<12}{'预处理ms/页':>12}{'OCR ms/页':>12}{'CER':>8}  各步骤ms/页")
+    for name, settings in profiles.items():
+        processor.preprocessing_steps = processor.build_preprocessing_pipeline(settings)
+        processor.preprocess_timings = {}
+
+        errors = 0
+        reference_chars = 0
+        preprocess_ms = 0.0
+        ocr_ms = 0.0
+        for image_path, reference in fixtures:
+            with Image.open(image_path) as image:
+                start_time = time.perf_counter()
+                processed = processor.preprocess_image(image)
+                preprocess_ms += (time.perf_counter() - start_time) * 1000
+
+            # 直接调用OCR，绕过结果缓存
+            start_time = time.perf_counter()
+            text = processor.ocr_backend.image_to_string(processed)
+            ocr_ms += (time.perf_counter() - start_time) * 1000
+
+            reference = normalize_text(reference)
+            errors += edit_distance(normalize_text(text), reference)
+            reference_chars += len(reference)
+
+        pages = len(fixtures)
+        steps = ', '.join(f"{step}={ms / pages:.1f}" for step, ms in processor.preprocess_timings.items())
+        cer = errors / reference_chars if reference_chars else 0.0
+        print(f"{name:<12}{preprocess_ms / pages:>12.1f}{ocr_ms / pages:>12.1f}{cer:>8.3f}  {steps or '-'}")
+
+def benchmark_ocr_backends(args):
+    """比较pytesseract与进程内tesserocr后端的初始化和单页识别耗时"""
+    import yaml
+    from PIL import Image
+    from ocr_backend import PytesseractBackend, TesserocrBackend
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        settings = yaml.safe_load(f)['pdf_processing']
+    language = settings['language']
+    ocr_config = '--oem 3 --psm 3'
+    fixtures = load_fixtures(args.fixtures)
+
+    backends = {
+        'pytesseract': lambda: PytesseractBackend(language, ocr_config, settings.get('tesseract_path')),
+        'tesserocr': lambda: TesserocrBackend(language, ocr_config, settings.get('tessdata_path')),
+    }
+
+    print(f"测试集: {len(fixtures)} 页")
+    print(f"{'后端':<14}{'初始化ms':>10}{'首页ms':>10}{'后续ms/页':>12}{'CER':>8}")
+    for name, factory in backends.items():
+        try:
+            start_time = time.perf_counter()
+            backend = factory()
+            init_ms = (time.perf_counter() - start_time) * 1000
+        except Exception as e:
+            print(f"{name:<14}不可用: {str(e)}")
+            continue
+
+        timings = []
+        errors = 0
+        reference_chars = 0
+        for image_path, reference in fixtures:
+            with Image.open(image_path) as image:
+                image.load()
+                start_time = time.perf_counter()
+                text = backend.image_to_string(image)
+                timings.append((time.perf_counter() - start_time) * 1000)
+
+            reference = normalize_text(reference)
+            errors += edit_distance(normalize_text(text), reference)
+            reference_chars += len(reference)
+        backend.close()
+
+        rest = timings[1:] or timings
+        cer = errors / reference_chars if reference_chars else 0.0
+        print(f"{name:<14}{init_ms:>10.1f}{timings[0]:>10.1f}{sum(rest) / len(rest):>12.1f}{cer:>8.3f}")
+
+# 在独立进程中测量导入和组件初始化耗时，保证每次都是冷启动
+STARTUP_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import yaml
+import main
+imported = time.perf_counter()
+with open(sys.argv[1], 'r', encoding='utf-8') as f:
+    config = yaml.safe_load(f)
+components = main.build_components(sys.argv[1], config, sys.argv[2].split(','))
+if sys.argv[3] == '1' and components['image_captioner'] is not None:
+    components['image_captioner']._load_model()
+built = time.perf_counter()
+try:
+    import resource
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+except ImportError:
+    rss_mb = None
+print(json.dumps({
+    'import_s': imported - start,
+    'init_s': built - imported,
+    'rss_mb': rss_mb,
+    'torch_loaded': 'torch' in sys.modules
+}))
+"""
+
+STARTUP_SCENARIOS = [
+    ('纯文本', 'ocr,clean', False),
+    ('文本+校正', 'ocr,clean,correct', False),
+    ('全部阶段', 'ocr,hexagram,clean,correct,caption', False),
+    ('全部阶段+加载BLIP', 'ocr,hexagram,clean,correct,caption', True),
+]
+
+def benchmark_startup(args):
+    """测量不同阶段组合下的导入耗时、初始化耗时和内存占用"""
+    config_path = str(Path(args.config).resolve())
+    src_dir = Path(__file__).resolve().parent
+
+    print(f"{'场景':<20}{'导入s':>8}{'初始化s':>10}{'峰值RSS MB':>12}  torch已导入")
+    for name, stages, load_models in STARTUP_SCENARIOS:
+        result = subprocess.run(
+            [sys.executable, '-c', STARTUP_SNIPPET, config_path, stages, '1' if load_models else '0'],
+            cwd=src_dir, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            print(f"{name:<20}失败: {result.stderr.strip().splitlines()[-1]}")
+            continue
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        rss = f"{stats['rss_mb']:.0f}" if stats['rss_mb'] is not None else '-'
+        print(f"{name:<20}{stats['import_s']:>8.2f}{stats['init_s']:>10.2f}{rss:>12}  {stats['torch_loaded']}")
+
+def benchmark_captions(args):
+    """测量不同批大小下BLIP描述生成的吞吐量"""
+    import yaml
+    from image_captioner import ImageCaptioner
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    captioner = ImageCaptioner(config)
+
+    image_paths = sorted(Path(args.images).glob('*.png'))
+    if not image_paths:
+        raise FileNotFoundError(f"目录中没有找到图片: {args.images}")
+    images = [captioner.load_image(str(path)) for path in image_paths]
+    # 图片不足时循环补齐，保证每个批大小至少跑满一批
+    images = (images * (args.count // len(images) + 1))[:args.count]
+
+    # 预热：加载模型并完成首次推理
+    captioner.describe_images(images[:1])
+
+    print(f"图片数: {len(images)}, 设备: {captioner.device}")
+    print(f"{'批大小':<8}{'耗时s':>10}{'图片/秒':>10}")
+    for batch_size in args.batch_sizes:
+        config['image_captioning']['batch_size'] = batch_size
+        start_time = time.perf_counter()
+        captioner.describe_images(images)
+        elapsed = time.perf_counter() - start_time
+        print(f"{batch_size:<8}{elapsed:>10.2f}{len(images) / elapsed:>10.2f}")
+
+# 在独立进程中运行一种CPU推理方案，峰值内存互不影响
+CPU_CAPTION_SNIPPET = """
+import json, sys, time
+from pathlib import Path
+import yaml
+from image_captioner import ImageCaptioner
+with open(sys.argv[1], 'r', encoding='utf-8') as f:
+    config = yaml.safe_load(f)
+config['image_captioning']['device'] = 'cpu'
+config['image_captioning']['cpu_optimized'] = json.loads(sys.argv[3])
+captioner = ImageCaptioner(config)
+images = [captioner.load_image(str(path)) for path in sorted(Path(sys.argv[2]).glob('*.png'))][:int(sys.argv[4])]
+start = time.perf_counter()
+captioner.describe_images(images[:1])
+load_s = time.perf_counter() - start
+start = time.perf_counter()
+captions = captioner.describe_images(images)
+elapsed = time.perf_counter() - start
+import resource
+print(json.dumps({
+    'load_s': load_s,
+    'ms_per_image': elapsed * 1000 / len(images),
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'captions': captions
+}, ensure_ascii=False))
+"""
+
+CPU_CAPTION_MODES = [
+    ('fp32', {'enable': False}),
+    ('int8', {'enable': True, 'quantize': True}),
+    ('int8+torchscript', {'enable': True, 'quantize': True, 'export': 'torchscript'}),
+    ('int8+onnx', {'enable': True, 'quantize': True, 'export': 'onnx'}),
+]
+
+def benchmark_cpu_captions(args):
+    """比较CPU上fp32与量化/导出方案的延迟、峰值内存和描述一致性"""
+    from difflib import SequenceMatcher
+
+    config_path = str(Path(args.config).resolve())
+    images_dir = str(Path(args.images).resolve())
+    src_dir = Path(__file__).resolve().parent
+
+    baseline = None
+    print(f"{'方案':<20}{'加载s':>8}{'ms/图':>10}{'峰值RSS MB':>12}{'与fp32相似度':>14}")
+    for name, settings in CPU_CAPTION_MODES:
+        settings = dict(settings, num_threads=args.threads, export_dir=str(Path(args.export_dir).resolve()))
+        result = subprocess.run(
+            [sys.executable, '-c', CPU_CAPTION_SNIPPET, config_path, images_dir,
+             json.dumps(settings), str(args.count)],
+            cwd=src_dir, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            print(f"{name:<20}失败: {result.stderr.strip().splitlines()[-1]}")
+            continue
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        if baseline is None:
+            baseline = stats['captions']
+        # 逐张比较单词序列的相似度后取平均
+        ratios = [
+            SequenceMatcher(None, a.split(), b.split()).ratio()
+            for a, b in zip(baseline, stats['captions'])
+        ]
+        similarity = sum(ratios) / len(ratios) if ratios else 0.0
+        print(f"{name:<20}{stats['load_s']:>8.2f}{stats['ms_per_image']:>10.1f}{stats['rss_mb']:>12.0f}{similarity:>14.3f}")
+
+def legacy_clean_text(text: str) -> str:
+    """重构前的 TextCleaner.clean_text，作为吞吐量对比基准"""
+    import re
+    import unicodedata
+    text = re.sub(r'\s+', ' ', text)
+    text = ''.join(ch for ch in text if unicodedata.category(ch)[0] != 'C')
+    text = re.sub(r'\n\s*\n', '\n', text)
+    text = re.sub(r'^\d+\s*$', '', text, flags=re.MULTILINE)
+    return text.strip()
+
+def synthetic_chinese_text(size_mb: float) -> str:
+    """生成带页码行、全角空格、空行和控制字符的中文测试文本"""
+    import random
+    rng = random.Random(0)
+    sentences = [
+        '梅花易数以先天八卦数起卦，', '乾一兑二离三震四巽五坎六艮七坤八。',
+        '凡占卜，以年月日时之数相加，', '除以八取余数为上卦，', '再加时数除以六得动爻。',
+        '　　体用生克，吉凶可判。', 'The hexagram is read bottom to top. ', '\u200b', '\x07'
+    ]
+    lines = []
+    size = 0
+    page = 1
+    target = int(size_mb * 1024 * 1024)
+    while size < target:
+        line = ''.join(rng.choice(sentences) for _ in range(rng.randint(2, 8)))
+        if rng.random() < 0.05:
+            line = f"\n  {page}  \n"
+            page += 1
+        lines.append(line)
+        size += len(line.encode('utf-8')) + 1
+    return '\n'.join(lines)
+
+def benchmark_clean_text(args):
+    """比较文本清理新旧实现的吞吐量（MB/秒）"""
+    import yaml
+    from text_cleaner import TextCleaner
+
+    if args.text:
+        text = Path(args.text).read_text(encoding='utf-8')
+    else:
+        text = synthetic_chinese_text(args.size_mb)
+    size_mb = len(text.encode('utf-8')) / 1024 / 1024
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    cleaner = TextCleaner(config)
+
+    print(f"文本大小: {size_mb:.1f} MB, 行数: {text.count(chr(10)) + 1}")
+    print(f"{'实现':<10}{'耗时s':>10}{'MB/秒':>10}{'输出行数':>10}")
+    for name, clean in [('旧实现', legacy_clean_text), ('单遍实现', cleaner.clean_text)]:
+        start_time = time.perf_counter()
+        for _ in range(args.repeat):
+            cleaned = clean(text)
+        elapsed = (time.perf_counter() - start_time) / args.repeat
+        print(f"{name:<10}{elapsed:>10.3f}{size_mb / elapsed:>10.1f}{cleaned.count(chr(10)) + 1:>10}")
+
+def benchmark_correction_modes(args):
+    """在同一批页面上比较全文校正与修改列表模式的输出令牌数和耗时"""
+    import yaml
+    from difflib import SequenceMatcher
+    from text_corrector import TextCorrector
+
+    # 按换页符分页（pdftotext的输出格式），没有换页符时整个文件作为一页
+    text = Path(args.text).read_text(encoding='utf-8')
+    pages = [page for page in text.split('\f') if page.strip()][:args.pages]
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    # 关闭缓存，两种模式都实际请求接口
+    config['text_correction']['cache'] = {'enable': False}
+    if args.base_url:
+        config['text_correction']['base_url'] = args.base_url
+
+    print(f"页数: {len(pages)}, 字符数: {sum(len(page) for page in pages)}")
+    print(f"{'模式':<8}{'请求数':>8}{'输入令牌':>10}{'输出令牌':>10}{'耗时s':>10}{'回退':>6}{'与全文一致':>12}")
+    results = {}
+    for mode in ['full', 'edits']:
+        corrector = TextCorrector({**config, 'text_correction': dict(config['text_correction'], mode=mode)})
+        start_time = time.perf_counter()
+        results[mode] = corrector.correct_texts(pages)
+        elapsed = time.perf_counter() - start_time
+        corrector.close()
+
+        stats = corrector.stats
+        similarity = SequenceMatcher(None, '\n'.join(results['full']), '\n'.join(results[mode])).ratio()
+        print(
+            f"{mode:<8}{stats['requests']:>8}{stats['prompt_tokens']:>10}{stats['completion_tokens']:>10}"
+            f"{elapsed:>10.2f}{stats['edit_fallbacks']:>6}{similarity:>12.3f}"
+        )
+
+def legacy_split_text(text: str, max_segment_length: int, overlap_length: int):
+    """重构前的 QAGenerator._split_text，返回 (段落列表, 是否正常结束)
+
+    原实现在起点不再前进时会无限循环，这里检测到后提前退出
+    """
+    segments = []
+    start = 0
+    while start < len(text):
+        if start + max_segment_length >= len(text):
+            segments.append(text[start:])
+            break
+        end = start + max_segment_length
+        while end > start and not (text[end] in '。！？.!?' and '\n' in text[end-10:end+10]):
+            end -= 1
+        if end == start:
+            end = start + max_segment_length
+        segments.append(text[start:end+1])
+        if end - overlap_length <= start:
+            return segments, False
+        start = end - overlap_length
+    return segments, True
+
+def benchmark_qa_split(args):
+    """比较问答生成分段的新旧实现耗时，并检查两者切分结果是否一致"""
+    import yaml
+    from qa_generator import QAGenerator
+
+    if args.text:
+        text = Path(args.text).read_text(encoding='utf-8')
+    else:
+        text = synthetic_chinese_text(args.size_mb)
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    generator = QAGenerator(config)
+    max_length, overlap = generator.max_segment_length, generator.overlap_length
+
+    print(f"文本字符数: {len(text)}, max_segment_length: {max_length}, overlap_length: {overlap}")
+    print(f"{'实现':<10}{'耗时s':>10}{'段落数':>10}")
+    start_time = time.perf_counter()
+    legacy_segments, finished = legacy_split_text(text, max_length, overlap)
+    elapsed = time.perf_counter() - start_time
+    print(f"{'旧实现':<10}{elapsed:>10.3f}{len(legacy_segments):>10}" + ('' if finished else '  （起点不再前进，原实现会无限循环）'))
+
+    start_time = time.perf_counter()
+    segments = generator._split_text(text)
+    elapsed = time.perf_counter() - start_time
+    print(f"{'断句索引':<10}{elapsed:>10.3f}{len(segments):>10}")
+    if finished:
+        print(f"切分结果一致: {segments == legacy_segments}")
+
+def main():
+    parser = argparse.ArgumentParser(description='性能基准测试')
+    parser.add_argument('--config', default='config/config.yaml', help='配置文件路径')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    preprocess_parser = subparsers.add_parser('preprocess', help='图像预处理方案耗时与OCR准确率对比')
+    preprocess_parser.add_argument('fixtures', help='测试集目录（*.png 与同名 *.txt 参考文本）')
+    preprocess_parser.set_defaults(func=benchmark_preprocess)
+
+    backend_parser = subparsers.add_parser('ocr-backends', help='pytesseract与tesserocr后端耗时对比')
+    backend_parser.add_argument('fixtures', help='测试集目录（*.png 与同名 *.txt 参考文本）')
+    backend_parser.set_defaults(func=benchmark_ocr_backends)
+
+    caption_parser = subparsers.add_parser('captions', help='不同批大小下BLIP描述生成的吞吐量')
+    caption_parser.add_argument('images', help='图片目录（*.png）')
+    caption_parser.add_argument('--count', type=int, default=64, help='参与测试的图片数量')
+    caption_parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32], help='要测试的批大小')
+    caption_parser.set_defaults(func=benchmark_captions)
+
+    cpu_caption_parser = subparsers.add_parser('cpu-captions', help='CPU上fp32与int8量化/导出方案的BLIP推理对比')
+    cpu_caption_parser.add_argument('images', help='图片目录（*.png）')
+    cpu_caption_parser.add_argument('--count', type=int, default=16, help='参与测试的图片数量')
+    cpu_caption_parser.add_argument('--threads', type=int, default=0, help='推理线程数，0表示使用全部CPU核心')
+    cpu_caption_parser.add_argument('--export-dir', default='output/blip_export', help='导出的视觉编码器存放目录')
+    cpu_caption_parser.set_defaults(func=benchmark_cpu_captions)
+
+    clean_parser = subparsers.add_parser('clean-text', help='文本清理新旧实现的吞吐量对比')
+    clean_parser.add_argument('text', nargs='?', help='UTF-8文本文件，省略时生成合成中文文本')
+    clean_parser.add_argument('--size-mb', type=float, default=8, help='合成文本的大小（MB）')
+    clean_parser.add_argument('--repeat', type=int, default=3, help='每种实现的重复次数')
+    clean_parser.set_defaults(func=benchmark_clean_text)
+
+    correction_parser = subparsers.add_parser('correction-modes', help='全文校正与修改列表模式的输出令牌数和耗时对比')
+    correction_parser.add_argument('text', help='OCR文本文件，页与页之间用换页符分隔')
+    correction_parser.add_argument('--pages', type=int, default=20, help='参与测试的页数')
+    correction_parser.add_argument('--base-url', help='覆盖配置中的接口地址，例如本地模拟服务')
+    correction_parser.set_defaults(func=benchmark_correction_modes)
+
+    qa_split_parser = subparsers.add_parser('qa-split', help='问答生成分段新旧实现的耗时对比')
+    qa_split_parser.add_argument('text', nargs='?', help='整本书的UTF-8文本文件，省略时生成合成中文文本')
+    qa_split_parser.add_argument('--size-mb', type=float, default=8, help='合成文本的大小（MB）')
+    qa_split_parser.set_defaults(func=benchmark_qa_split)
+
+    startup_parser = subparsers.add_parser('startup', help='不同阶段组合的启动耗时与内存')
+    startup_parser.set_defaults(func=benchmark_startup)
+
+    args = parser.parse_args()
+    setup_logging()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import logging
+from pathlib import Path
+import torch
+
+class _ExportedVisionEncoder(torch.nn.Module):
+    """包装导出的视觉编码器，保持与BLIP视觉模型相同的调用方式和输出格式"""
+
+    def __init__(self, run):
+        super().__init__()
+        self.run = run
+
+    def forward(self, pixel_values=None, *args, **kwargs):
+        return (self.run(pixel_values),)
+
+class _TorchScriptVisionOutput(torch.nn.Module):
+    """导出时只保留视觉编码器的 last_hidden_state"""
+
+    def __init__(self, vision_model):
+        super().__init__()
+        self.vision_model = vision_model
+
+    def forward(self, pixel_values):
+        return self.vision_model(pixel_values=pixel_values, return_dict=False)[0]
+
+def _export_torchscript(model, export_dir, image_size, logger):
+    path = Path(export_dir) / 'blip_vision.pt'
+    if path.exists():
+        logger.info(f"加载已导出的TorchScript视觉编码器: {path}")
+        return torch.jit.load(str(path))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    example = torch.zeros(1, 3, image_size, image_size)
+    with torch.inference_mode():
+        traced = torch.jit.trace(_TorchScriptVisionOutput(model.vision_model).eval(), example)
+    traced.save(str(path))
+    logger.info(f"视觉编码器已导出为TorchScript: {path}")
+    return traced
+
+def _export_onnx(model, export_dir, image_size, num_threads, logger):
+    import onnxruntime
+
+    path = Path(export_dir) / 'blip_vision.onnx'
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        example = torch.zeros(1, 3, image_size, image_size)
+        torch.onnx.export(
+            _TorchScriptVisionOutput(model.vision_model).eval(), example, str(path),
+            input_names=['pixel_values'], output_names=['last_hidden_state'],
+            dynamic_axes={'pixel_values': {0: 'batch'}, 'last_hidden_state': {0: 'batch'}},
+            opset_version=14
+        )
+        logger.info(f"视觉编码器已导出为ONNX: {path}")
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = num_threads
+    session = onnxruntime.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+
+    def run(pixel_values):
+        outputs = session.run(None, {'pixel_values': pixel_values.cpu().numpy()})
+        return torch.from_numpy(outputs[0])
+
+    return run
+
+def optimize_for_cpu(model, settings, image_size=384):
+    """CPU推理优化：设置线程数、动态int8量化线性层，并可选导出视觉编码器"""
+    logger = logging.getLogger(__name__)
+
+    num_threads = settings.get('num_threads') or os.cpu_count() or 1
+    torch.set_num_threads(num_threads)
+    logger.info(f"CPU推理线程数: {num_threads}")
+
+    model = model.to('cpu').eval()
+
+    # 视觉编码器先于量化导出，保持其fp32精度
+    export = settings.get('export')
+    export_dir = settings.get('export_dir', 'output/blip_export')
+    if export == 'torchscript':
+        model.vision_model = _ExportedVisionEncoder(_export_torchscript(model, export_dir, image_size, logger))
+    elif export == 'onnx':
+        try:
+            model.vision_model = _ExportedVisionEncoder(
+                _export_onnx(model, export_dir, image_size, num_threads, logger)
+            )
+        except ImportError:
+            logger.warning("未安装onnxruntime，视觉编码器保持PyTorch执行")
+
+    if settings.get('quantize', True):
+        # 导出后的视觉编码器不再是普通模块，只量化文本解码器
+        if isinstance(model.vision_model, _ExportedVisionEncoder):
+            model.text_decoder = torch.quantization.quantize_dynamic(
+                model.text_decoder, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        else:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        logger.info("已对线性层进行动态int8量化")
+
+    return model
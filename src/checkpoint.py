@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+class CheckpointStore:
+    """按阶段、按页保存处理结果，支持中断后从已完成的位置继续"""
+
+    def __init__(self, run_dir, stages: List[str], resume: bool = False):
+        self.logger = logging.getLogger(__name__)
+        self.run_dir = Path(run_dir)
+        self.resume = resume
+
+        # 非恢复模式下清空旧的检查点，避免与本次运行的结果混用；
+        # 目录可由 --run-dir 任意指定，只删除各阶段的检查点子目录和运行报告
+        if not resume:
+            for stage in stages:
+                if (self.run_dir / stage).is_dir():
+                    shutil.rmtree(self.run_dir / stage)
+            (self.run_dir / 'report.json').unlink(missing_ok=True)
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+
+        self.reused = {}
+
+    def _path(self, stage: str, page_number: int) -> Path:
+        return self.run_dir / stage / f"page_{page_number:05d}.json"
+
+    def has(self, stage: str, page_number: int) -> bool:
+        return self.resume and self._path(stage, page_number).exists()
+
+    def load(self, stage: str, page_number: int) -> Optional[Dict]:
+        """读取检查点，不存在或已损坏时返回None"""
+        if not self.has(stage, page_number):
+            return None
+        try:
+            with open(self._path(stage, page_number), 'r', encoding='utf-8') as f:
+                page_data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            self.logger.warning(f"检查点损坏，将重新处理: {stage} 第 {page_number} 页: {str(e)}")
+            return None
+        self.reused[stage] = self.reused.get(stage, 0) + 1
+        return page_data
+
+    def load_latest(self, stages: List[str], page_number: int) -> Optional[Tuple[str, Dict]]:
+        """读取指定阶段中最后写入的检查点，返回 (阶段, 页面数据)
+
+        每次保存的都是页面当时的完整状态，最后写入的检查点包含的已完成阶段最多；
+        各阶段的执行顺序可能因 --stages 不同而变化，不能按阶段顺序判断
+        """
+        candidates = [stage for stage in stages if self.has(stage, page_number)]
+        candidates.sort(key=lambda stage: self._path(stage, page_number).stat().st_mtime_ns, reverse=True)
+        for stage in candidates:
+            page_data = self.load(stage, page_number)
+            if page_data is not None:
+                return stage, page_data
+        return None
+
+    def save(self, stage: str, page_data: Dict) -> None:
+        """原子写入检查点，内存中的图像数据不落盘"""
+        path = self._path(stage, page_data['page_number'])
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        serializable = dict(page_data)
+        serializable['images'] = [
+            {key: value for key, value in image.items() if key != 'roi'}
+            for image in page_data.get('images', [])
+        ]
+
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(serializable, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def save_report(self, report: Dict) -> None:
+        """保存本次运行的统计报告"""
+        with open(self.run_dir / 'report.json', 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,175 @@
+import argparse
+import hashlib
+import sqlite3
+import threading
+import time
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+import yaml
+
+class CorrectionCache:
+    """基于SQLite的文本校正结果缓存，按段落文本、模型、提示词版本和采样参数寻址
+
+    同时记录每条结果消耗的令牌数，命中时累计节省的令牌
+    """
+
+    def __init__(self, db_path, max_size_mb: float = 256):
+        self.logger = logging.getLogger(__name__)
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+
+        # 校正请求在后台事件循环线程中查询缓存
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+            'prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, '
+            'created REAL NOT NULL, last_access REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_last_access ON entries(last_access)')
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(text: str, **params) -> str:
+        """由段落文本和模型、提示词版本、采样参数生成缓存键"""
+        digest = hashlib.sha256(text.encode('utf-8'))
+        for name in sorted(params):
+            digest.update(f"|{name}={params[name]}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存，命中时刷新访问时间并累计节省的令牌"""
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT value, prompt_tokens, completion_tokens FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.saved_prompt_tokens += row[1]
+            self.saved_completion_tokens += row[2]
+            self.conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def put(self, key: str, value: str, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+        """写入缓存并按容量淘汰最久未使用的条目"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO entries '
+                '(key, value, size, prompt_tokens, completion_tokens, created, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, value, len(value.encode('utf-8')), prompt_tokens, completion_tokens, now, now)
+            )
+            if self.max_bytes is not None:
+                self.evictions += self._evict_to(self.max_bytes)
+            self.conn.commit()
+
+    def _evict_to(self, max_bytes: int) -> int:
+        """删除最久未使用的条目直到总大小不超过上限，返回删除的条目数"""
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= max_bytes:
+            return 0
+
+        removed = 0
+        rows = self.conn.execute('SELECT key, size FROM entries ORDER BY last_access').fetchall()
+        for key, size in rows:
+            if total <= max_bytes:
+                break
+            self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+            removed += 1
+        return removed
+
+    def prune(self, max_age_days: float = None, max_size_mb: float = None) -> int:
+        """删除超过指定天数未使用的条目，并按LRU将缓存压缩到指定大小，返回删除的条目数"""
+        removed = 0
+        with self._lock:
+            if max_age_days is not None:
+                cutoff = time.time() - max_age_days * 86400
+                removed += self.conn.execute('DELETE FROM entries WHERE last_access < ?', (cutoff,)).rowcount
+            if max_size_mb is not None:
+                removed += self._evict_to(int(max_size_mb * 1024 * 1024))
+            self.conn.commit()
+            self.conn.execute('VACUUM')
+        return removed
+
+    def summary(self) -> Dict:
+        """缓存中的条目数、总大小和已缓存结果的令牌数"""
+        with self._lock:
+            entries, size, prompt_tokens, completion_tokens = self.conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(prompt_tokens), 0), '
+                'COALESCE(SUM(completion_tokens), 0) FROM entries'
+            ).fetchone()
+        return {
+            'entries': entries,
+            'size_mb': round(size / 1024 / 1024, 3),
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens
+        }
+
+    def counters(self) -> Dict:
+        """返回命中率和节省的令牌数"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'saved_prompt_tokens': self.saved_prompt_tokens,
+            'saved_completion_tokens': self.saved_completion_tokens
+        }
+
+    def close(self) -> None:
+        self.conn.close()
+
+def default_cache_path(config: Dict) -> Path:
+    cache_config = config['text_correction'].get('cache', {})
+    return Path(cache_config.get('path') or Path(config['output']['output_dir']) / 'correction_cache.sqlite')
+
+def main():
+    parser = argparse.ArgumentParser(description='文本校正缓存维护')
+    parser.add_argument('--config', default='config/config.yaml', help='配置文件路径')
+    parser.add_argument('--path', help='缓存文件路径，默认读取配置文件')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('stats', help='查看缓存条目数、大小和已缓存的令牌数')
+    prune_parser = subparsers.add_parser('prune', help='按未使用天数或总大小清理缓存')
+    prune_parser.add_argument('--max-age-days', type=float, help='删除超过该天数未使用的条目')
+    prune_parser.add_argument('--max-size-mb', type=float, help='按最久未使用顺序删除，直到不超过该大小')
+    args = parser.parse_args()
+
+    if args.path:
+        cache_path = Path(args.path)
+    else:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            cache_path = default_cache_path(yaml.safe_load(f))
+    if not cache_path.exists():
+        raise FileNotFoundError(f"缓存文件不存在: {cache_path}")
+
+    cache = CorrectionCache(cache_path, max_size_mb=None)
+    try:
+        if args.command == 'prune':
+            if args.max_age_days is None and args.max_size_mb is None:
+                parser.error('prune 需要指定 --max-age-days 或 --max-size-mb')
+            removed = cache.prune(args.max_age_days, args.max_size_mb)
+            print(f"已删除 {removed} 条缓存")
+        print(cache.summary())
+    finally:
+        cache.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,4 @@
 import json
-import pandas as pd
 from pathlib import Path
 import logging
 from typing import List, Dict
@@ -21,31 +20,37 @@ class DataFormatter:
         except Exception as e:
             self.logger.error(f"保存JSON数据时发生错误: {str(e)}")
     
-    def format_to_training_data(self, data: List[Dict]) -> List[Dict]:
-        """将数据转换为训练格式"""
+    def format_page(self, page: Dict) -> List[Dict]:
+        """将单页数据转换为训练格式"""
         training_data = []
         
-        for page in data:
-            # 处理文本段落
-            if page['text'].strip():
+        # 处理文本段落
+        if page['text'].strip():
+            training_data.append({
+                'type': 'text',
+                'content': page['text'],
+                'page': page['page_number']
+            })
+        
+        # 处理图片描述
+        for img in page.get('images', []):
+            if img.get('caption'):
                 training_data.append({
-                    'type': 'text',
-                    'content': page['text'],
-                    'page': page['page_number']
+                    'type': 'image',
+                    'content': img['caption'],
+                    'page': page['page_number'],
+                    'image_path': img.get('path', '')
                 })
-            
-            # 处理图片描述
-            for img in page.get('images', []):
-                if img.get('caption'):
-                    training_data.append({
-                        'type': 'image',
-                        'content': img['caption'],
-                        'page': page['page_number'],
-                        'image_path': img.get('path', '')
-                    })
         
         return training_data
     
+    def format_to_training_data(self, data: List[Dict]) -> List[Dict]:
+        """将数据转换为训练格式"""
+        training_data = []
+        for page in data:
+            training_data.extend(self.format_page(page))
+        return training_data
+    
     def save_training_data(self, data: List[Dict], output_file: str = 'training_data.json') -> None:
         """保存训练数据"""
         formatted_data = self.format_to_training_data(data)
@@ -0,0 +1,68 @@
+import json
+import re
+from typing import Dict, List
+
+_CODE_FENCE = re.compile(r'^```(?:json)?\s*|\s*```$')
+
+class EditScriptError(ValueError):
+    """修改列表格式错误或无法唯一定位到原文"""
+
+def parse_edits(content: str) -> List[Dict]:
+    """解析模型返回的修改列表：[{"old": 错误片段, "new": 修正片段, "before": 错误片段之前紧邻的文字}]"""
+    try:
+        edits = json.loads(_CODE_FENCE.sub('', content.strip()))
+    except json.JSONDecodeError as e:
+        raise EditScriptError(f"修改列表不是合法的JSON: {str(e)}")
+    if not isinstance(edits, list):
+        raise EditScriptError("修改列表必须是JSON数组")
+    for edit in edits:
+        if not isinstance(edit, dict) or not isinstance(edit.get('old'), str) or not isinstance(edit.get('new'), str):
+            raise EditScriptError(f"修改项缺少 old/new 字段: {edit}")
+        if not edit['old']:
+            raise EditScriptError(f"修改项的 old 为空: {edit}")
+        if not isinstance(edit.get('before', ''), str):
+            raise EditScriptError(f"修改项的 before 必须是字符串: {edit}")
+    return edits
+
+def _locate(text: str, edit: Dict, start: int) -> int:
+    """返回 start 之后第一处紧跟在 before 之后的错误片段位置"""
+    old = edit['old']
+    before = edit.get('before', '')
+    position = text.find(old, start)
+    while position != -1 and not text.endswith(before, 0, position):
+        position = text.find(old, position + 1)
+    if position == -1:
+        raise EditScriptError(f"修改项在原文中找不到: {edit}")
+    return position
+
+def apply_edits(text: str, edits: List[Dict]) -> str:
+    """按原文顺序应用修改列表：每项从上一项之后查找，重复出现的片段依次对应
+
+    任何一项找不到（包括顺序错乱或相互重叠）时整体失败
+    """
+    parts = []
+    cursor = 0
+    for edit in edits:
+        position = _locate(text, edit, cursor)
+        parts.append(text[cursor:position])
+        parts.append(edit['new'])
+        cursor = position + len(edit['old'])
+    parts.append(text[cursor:])
+    return ''.join(parts)
+
+def parse_window_fixes(content: str, count: int) -> Dict[int, str]:
+    """解析模型对编号可疑片段的修正：{"编号": 修正后的文字}，没有错误的片段可以省略"""
+    try:
+        fixes = json.loads(_CODE_FENCE.sub('', content.strip()))
+    except json.JSONDecodeError as e:
+        raise EditScriptError(f"片段修正不是合法的JSON: {str(e)}")
+    if not isinstance(fixes, dict):
+        raise EditScriptError("片段修正必须是JSON对象")
+    parsed = {}
+    for key, value in fixes.items():
+        if not str(key).isdigit() or not 1 <= int(key) <= count:
+            raise EditScriptError(f"片段编号不存在: {key}")
+        if not isinstance(value, str):
+            raise EditScriptError(f"片段 {key} 的修正必须是字符串: {value}")
+        parsed[int(key)] = value
+    return parsed
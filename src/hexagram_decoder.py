@@ -0,0 +1,178 @@
+import cv2
+import numpy as np
+from typing import Dict, List, Optional
+
+# 八卦：爻序自下而上，1为阳爻，0为阴爻
+TRIGRAMS = {
+    '乾': ((1, 1, 1), '天'),
+    '兑': ((1, 1, 0), '泽'),
+    '离': ((1, 0, 1), '火'),
+    '震': ((1, 0, 0), '雷'),
+    '巽': ((0, 1, 1), '风'),
+    '坎': ((0, 1, 0), '水'),
+    '艮': ((0, 0, 1), '山'),
+    '坤': ((0, 0, 0), '地'),
+}
+
+# 文王卦序：行为下卦、列为上卦，顺序均为 乾 震 坎 艮 坤 巽 离 兑
+KING_WEN_ORDER = ['乾', '震', '坎', '艮', '坤', '巽', '离', '兑']
+KING_WEN_MATRIX = [
+    [1, 34, 5, 26, 11, 9, 14, 43],
+    [25, 51, 3, 27, 24, 42, 21, 17],
+    [6, 40, 29, 4, 7, 59, 64, 47],
+    [33, 62, 39, 52, 15, 53, 56, 31],
+    [12, 16, 8, 23, 2, 20, 35, 45],
+    [44, 32, 48, 18, 46, 57, 50, 28],
+    [13, 55, 63, 22, 36, 37, 30, 49],
+    [10, 54, 60, 41, 19, 61, 38, 58],
+]
+
+HEXAGRAM_NAMES = [
+    '乾', '坤', '屯', '蒙', '需', '讼', '师', '比', '小畜', '履',
+    '泰', '否', '同人', '大有', '谦', '豫', '随', '蛊', '临', '观',
+    '噬嗑', '贲', '剥', '复', '无妄', '大畜', '颐', '大过', '坎', '离',
+    '咸', '恒', '遁', '大壮', '晋', '明夷', '家人', '睽', '蹇', '解',
+    '损', '益', '夬', '姤', '萃', '升', '困', '井', '革', '鼎',
+    '震', '艮', '渐', '归妹', '丰', '旅', '巽', '兑', '涣', '节',
+    '中孚', '小过', '既济', '未济',
+]
+
+def _lines_to_key(lines) -> int:
+    """将自下而上的爻序编码为整数，第一爻为最低位"""
+    return sum(bit << i for i, bit in enumerate(lines))
+
+def _build_tables():
+    """预先计算八卦和六十四卦查找表"""
+    trigram_table = {}
+    for name, (lines, nature) in TRIGRAMS.items():
+        trigram_table[_lines_to_key(lines)] = {'name': name, 'nature': nature, 'lines': list(lines)}
+
+    hexagram_table = {}
+    for row, lower in enumerate(KING_WEN_ORDER):
+        for column, upper in enumerate(KING_WEN_ORDER):
+            number = KING_WEN_MATRIX[row][column]
+            lines = TRIGRAMS[lower][0] + TRIGRAMS[upper][0]
+            name = HEXAGRAM_NAMES[number - 1]
+            if upper == lower:
+                full_name = f"{upper}为{TRIGRAMS[upper][1]}"
+            else:
+                full_name = f"{TRIGRAMS[upper][1]}{TRIGRAMS[lower][1]}{name}"
+            hexagram_table[_lines_to_key(lines)] = {
+                'number': number,
+                'name': name,
+                'full_name': full_name,
+                'upper': upper,
+                'lower': lower,
+                'lines': list(lines)
+            }
+    return trigram_table, hexagram_table
+
+TRIGRAM_TABLE, HEXAGRAM_TABLE = _build_tables()
+
+def _runs(mask: np.ndarray) -> List[tuple]:
+    """返回布尔数组中连续为真的区间 [start, end)"""
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return list(zip(edges[::2], edges[1::2]))
+
+def find_line_bands(binary: np.ndarray, min_fill: float = 0.25) -> List[tuple]:
+    """通过行投影找出爻线所在的水平带，返回自上而下的 (top, bottom, left, right)"""
+    row_profile = binary.mean(axis=1)
+    if row_profile.max() == 0:
+        return []
+
+    bands = []
+    min_run = 0.05 * binary.shape[1]
+    for top, bottom in _runs(row_profile >= min_fill * row_profile.max()):
+        # 外框竖边、噪点等窄的着墨列不计入爻线的左右边界
+        runs = [
+            (start, end) for start, end in _runs(binary[top:bottom].mean(axis=0) >= 0.5)
+            if end - start >= min_run
+        ]
+        if runs:
+            bands.append((top, bottom, runs[0][0], runs[-1][1]))
+    if not bands:
+        return []
+
+    # 过滤文字等干扰：爻线宽度应接近最宽的那一条
+    widest = max(right - left for _, _, left, right in bands)
+    return [band for band in bands if band[3] - band[2] >= 0.6 * widest]
+
+def classify_line(binary: np.ndarray, band, min_gap_ratio: float = 0.08, min_density: float = 0.8) -> Optional[int]:
+    """根据带内列投影判断阳爻（实线）或阴爻（中间断开），不是实心爻线时返回None
+
+    爻线是实心的长条：除阴爻中部唯一的缺口外，整条带几乎全部着墨
+    """
+    top, bottom, left, right = band
+    width = right - left
+    if width < 3 * (bottom - top):
+        return None
+    region = binary[top:bottom, left:right]
+    inked = region.mean(axis=0) >= 0.5
+    # 宽度不足2%的缺口视为扫描噪点
+    gaps = [(start, end) for start, end in _runs(~inked) if end - start >= 0.02 * width]
+    if not gaps:
+        line = 1
+    elif len(gaps) == 1:
+        start, end = gaps[0]
+        # 阴爻的缺口位于正中
+        if not (min_gap_ratio * width <= end - start <= 0.4 * width and 0.4 * width <= (start + end) / 2 <= 0.6 * width):
+            return None
+        line = 0
+    else:
+        return None
+
+    if region[:, inked].mean() < min_density:
+        return None
+    return line
+
+def _regular_bands(bands) -> bool:
+    """爻线高度相近、间距均匀、左右两端对齐"""
+    heights = [bottom - top for top, bottom, _, _ in bands]
+    if max(heights) > 1.5 * min(heights) + 2:
+        return False
+    centers = [(top + bottom) / 2 for top, bottom, _, _ in bands]
+    spacings = np.diff(centers)
+    if spacings.max() - spacings.min() > 0.25 * np.median(spacings) + 2:
+        return False
+    width = np.median([right - left for _, _, left, right in bands])
+    for edges in ([left for _, _, left, _ in bands], [right for _, _, _, right in bands]):
+        if max(edges) - min(edges) > 0.05 * width + 2:
+            return False
+    return True
+
+def decode_hexagram(image) -> Optional[Dict]:
+    """解码卦象图：识别六爻（或三爻）并查表得到卦名、上下卦和文王卦序，无法识别时返回None
+
+    文字块等非卦象图也会形成若干水平带，只有每条带都是实心爻线且排列规整时才认为是卦象
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    bands = find_line_bands(binary)
+    # 检测区域由外框轮廓裁出时，外框上下边也会形成水平带，需要去掉
+    height = binary.shape[0]
+    if len(bands) in (5, 8) and bands[0][0] <= 0.03 * height and bands[-1][1] >= 0.97 * height:
+        bands = bands[1:-1]
+    if len(bands) not in (3, 6) or not _regular_bands(bands):
+        return None
+
+    # 图像坐标自上而下，爻序自下而上
+    lines = [classify_line(binary, band) for band in reversed(bands)]
+    if None in lines:
+        return None
+    key = _lines_to_key(lines)
+    if len(lines) == 6:
+        return dict(HEXAGRAM_TABLE[key], kind='hexagram')
+    trigram = TRIGRAM_TABLE[key]
+    return {'kind': 'trigram', 'name': trigram['name'], 'nature': trigram['nature'], 'lines': lines}
+
+def describe_decoded(decoded: Dict) -> str:
+    """将解码结果转换为中文描述"""
+    lines = ''.join('⚊' if bit else '⚋' for bit in decoded['lines'])
+    if decoded['kind'] == 'trigram':
+        return f"图中为{decoded['name']}卦（{decoded['nature']}），爻象自下而上为{lines}。"
+    return (
+        f"图中为第{decoded['number']}卦{decoded['full_name']}，"
+        f"上卦{decoded['upper']}、下卦{decoded['lower']}，爻象自下而上为{lines}。"
+    )
@@ -1,37 +1,83 @@
+import hashlib
 import cv2
 import numpy as np
-from transformers import BlipProcessor, BlipForConditionalGeneration
 from PIL import Image
-import torch
 import logging
+from ocr_backend import create_ocr_backend
+from phash_index import PerceptualHashIndex, hamming_distance
+from hexagram_decoder import decode_hexagram, describe_decoded
 
 class ImageCaptioner:
     def __init__(self, config):
         self.config = config
-        self.device = torch.device(config['image_captioning']['device'])
         self.logger = logging.getLogger(__name__)
         
-        # 加载BLIP模型
-        self.processor = BlipProcessor.from_pretrained(
-            config['image_captioning']['model_name']
-        )
-        self.model = BlipForConditionalGeneration.from_pretrained(
-            config['image_captioning']['model_name']
-        ).to(self.device)
+        # BLIP模型在第一次生成描述时才加载，避免纯文本任务导入torch
+        self.device = None
+        self.processor = None
+        self.model = None
         
-        # 添加OCR配置
+        # 添加OCR配置，OCR后端同样在首次使用时创建
         self.use_ocr = True
-        if self.use_ocr:
-            import pytesseract
-            pytesseract.pytesseract.tesseract_cmd = config.get('pdf_processing', {}).get(
-                'tesseract_path', 'tesseract'
+        self._ocr_backend = None
+        
+        # 本次运行内按图片内容哈希缓存分析结果和BLIP描述，同一图片只计算一次
+        self._analysis_memo = {}
+        self._description_memo = {}
+        self._decoded_memo = {}
+        self.memo_stats = {
+            'analysis_hits': 0,
+            'analysis_misses': 0,
+            'caption_hits': 0,
+            'caption_misses': 0,
+            'dedupe_hits': 0
+        }
+        
+        # 跨页（可选跨书）去重：近似相同的卦象图只生成一次BLIP描述
+        dedupe = config['image_captioning'].get('dedupe', {})
+        self.dedupe_index = None
+        if dedupe.get('enable', True):
+            self.dedupe_index = PerceptualHashIndex(
+                max_distance=dedupe.get('max_distance', 10),
+                index_path=dedupe.get('index_path'),
+                namespace=config['image_captioning']['model_name'],
+                hash_size=dedupe.get('hash_size', 16),
+                tolerance=dedupe.get('tolerance', 4)
             )
     
+    def _load_model(self):
+        """按需导入torch/transformers并加载BLIP模型"""
+        if self.model is not None:
+            return
+        import torch
+        from transformers import BlipProcessor, BlipForConditionalGeneration
+        
+        settings = self.config['image_captioning']
+        cpu_optimized = settings.get('cpu_optimized', {})
+        
+        self.logger.info("加载BLIP模型...")
+        self.device = torch.device('cpu' if cpu_optimized.get('enable') else settings['device'])
+        self.processor = BlipProcessor.from_pretrained(settings['model_name'])
+        model = BlipForConditionalGeneration.from_pretrained(settings['model_name'])
+        
+        # 无GPU主机上：限制线程数、int8动态量化，可选导出视觉编码器
+        if cpu_optimized.get('enable'):
+            from blip_cpu import optimize_for_cpu
+            image_size = self.processor.image_processor.size['height']
+            model = optimize_for_cpu(model, cpu_optimized, image_size)
+        self.model = model.to(self.device).eval()
+    
+    @property
+    def ocr_backend(self):
+        if self._ocr_backend is None:
+            self._ocr_backend = create_ocr_backend(self.config.get('pdf_processing', {}))
+        return self._ocr_backend
+    
     def detect_hexagram_features(self, image):
         """检测卦象图案的特征"""
         try:
             # 转换为灰度图
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             
             # 二值化处理
             _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
@@ -76,45 +122,107 @@ class ImageCaptioner:
         if lines is None:
             return False
             
-        # 统计水平线数量
-        horizontal_lines = 0
-        for line in lines:
-            x1, y1, x2, y2 = line[0]
-            angle = abs(np.arctan2(y2 - y1, x2 - x1) * 180 / np.pi)
-            if abs(angle) < 10:  # 允许10度的误差
-                horizontal_lines += 1
+        # 统计水平线数量（允许10度的误差）
+        segments = np.asarray(lines, dtype=np.float32).reshape(-1, 4)
+        angles = np.degrees(np.arctan2(segments[:, 3] - segments[:, 1], segments[:, 2] - segments[:, 0]))
+        angles = np.abs(angles)
+        horizontal_lines = int(np.count_nonzero(np.minimum(angles, 180 - angles) < 10))
         
         # 卦象通常有6到8条水平线
         return 6 <= horizontal_lines <= 8
     
+    def decode_hexagram(self, image):
+        """按爻线投影解码卦象，返回卦名、上下卦和文王卦序，无法识别时返回None"""
+        if not self.config['image_captioning'].get('decode_hexagrams', True):
+            return None
+        image = self.load_image(image)
+        key = self.image_hash(image)
+        if key not in self._decoded_memo:
+            self._decoded_memo[key] = decode_hexagram(image)
+        return self._decoded_memo[key]
+    
     def extract_text(self, image):
         """提取图片中的文字"""
         try:
             if not self.use_ocr:
                 return ""
-            import pytesseract
-            text = pytesseract.image_to_string(image, lang='chi_sim+eng')
+            text = self.ocr_backend.image_to_string(image)
             return text.strip()
         except Exception as e:
             self.logger.error(f"文字提取失败: {str(e)}")
             return ""
     
-    def analyze_hexagram(self, image_path):
-        """分析卦象图片并生成描述"""
+    def load_image(self, image):
+        """读取图片，已在内存中的OpenCV数组直接使用"""
+        if isinstance(image, np.ndarray):
+            return image
+        loaded = cv2.imread(image)
+        if loaded is None:
+            raise ValueError("无法读取图片")
+        return loaded
+    
+    def to_pil_image(self, image):
+        """将图片路径或OpenCV数组转换为RGB格式的PIL图像"""
+        image = self.load_image(image)
+        if image.ndim == 2:
+            return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_GRAY2RGB))
+        return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    
+    def dedupe_ratio(self):
+        """未送入BLIP的图片（精确或近似重复）占全部图片的比例"""
+        stats = self.memo_stats
+        total = stats['caption_hits'] + stats['dedupe_hits'] + stats['caption_misses']
+        return (stats['caption_hits'] + stats['dedupe_hits']) / total if total else 0.0
+    
+    @staticmethod
+    def image_hash(image):
+        """计算图片内容哈希，作为本次运行内的缓存键"""
+        digest = hashlib.sha1(f"{image.shape}:{image.dtype}".encode('utf-8'))
+        digest.update(np.ascontiguousarray(image).tobytes())
+        return digest.hexdigest()
+    
+    def analyze_hexagram(self, image, text=None):
+        """分析卦象图片并生成描述
+        
+        image可以是图片路径或OpenCV数组，text为页面版面分析中已识别的区域文字
+        """
         try:
             # 读取图片
-            image = cv2.imread(image_path)
-            if image is None:
-                raise ValueError("无法读取图片")
+            image = self.load_image(image)
+        except Exception as e:
+            self.logger.error(f"卦象分析失败: {str(e)}")
+            return "图片分析失败"
+        
+        key = (self.image_hash(image), text)
+        if key in self._analysis_memo:
+            self.memo_stats['analysis_hits'] += 1
+            return self._analysis_memo[key]
+        
+        self.memo_stats['analysis_misses'] += 1
+        analysis = self._analyze_hexagram(image, text)
+        self._analysis_memo[key] = analysis
+        return analysis
+    
+    def _analyze_hexagram(self, image, text):
+        """对已读取的图片执行卦象特征检测和文字提取"""
+        try:
+            # 提取文字，已有页面识别结果时不再单独OCR
+            if text is None:
+                text = self.extract_text(image)
+            
+            # 能直接解码爻线时输出结构化结果，无需Hough特征检测
+            decoded = self.decode_hexagram(image)
+            if decoded is not None:
+                feature_text = describe_decoded(decoded)
+                if text:
+                    feature_text += f"\n图中包含文字信息：{text}"
+                return feature_text
             
             # 检测卦象特征
             features = self.detect_hexagram_features(image)
             if not features:
                 return "无法识别卦象特征"
             
-            # 提取文字
-            text = self.extract_text(image)
-            
             # 生成描述
             feature_text = "图中"
             if features['has_circle'] and features['has_rectangle']:
@@ -141,31 +249,131 @@ class ImageCaptioner:
             self.logger.error(f"卦象分析失败: {str(e)}")
             return "图片分析失败"
     
-    def generate_caption(self, image_path):
+    def generate_caption(self, image, text=None):
         """生成完整的图片描述"""
+        return self.generate_captions([image], [text])[0]
+    
+    def generate_captions(self, images, texts=None):
+        """批量生成完整的图片描述，BLIP推理按批次进行"""
+        texts = texts or [None] * len(images)
+        captions = ["图片描述生成失败"] * len(images)
+        
+        # 首先逐张进行卦象分析
+        loaded = []
+        analyses = []
+        for index, (image, text) in enumerate(zip(images, texts)):
+            try:
+                image = self.load_image(image)
+            except Exception as e:
+                self.logger.error(f"生成图片描述失败: {str(e)}")
+                continue
+            analysis = self.analyze_hexagram(image, text)
+            # 已解码的卦象图描述已完整，不再送入BLIP
+            if self.decode_hexagram(image) is not None:
+                captions[index] = analysis
+                continue
+            loaded.append((index, image))
+            analyses.append(analysis)
+        
+        # 使用BLIP批量生成基础描述，已描述过的图片直接复用
+        hashes = [self.image_hash(image) for _, image in loaded]
+        missing = {}
+        for image_hash, (_, image) in zip(hashes, loaded):
+            if image_hash in self._description_memo or image_hash in missing:
+                self.memo_stats['caption_hits'] += 1
+            else:
+                missing[image_hash] = image
+        
+        # 近似相同的图形共享同一描述，同一批内的近似图形只保留一张送入BLIP
+        duplicates = {}
+        if self.dedupe_index is not None:
+            representatives = []
+            for image_hash, image in list(missing.items()):
+                perceptual_hash = self.dedupe_index.hash(image)
+                description = self.dedupe_index.lookup(perceptual_hash)
+                if description is not None:
+                    self._description_memo[image_hash] = description
+                    del missing[image_hash]
+                    self.memo_stats['dedupe_hits'] += 1
+                    continue
+                for representative_hash, representative in representatives:
+                    if hamming_distance(perceptual_hash, representative_hash) <= self.dedupe_index.max_distance:
+                        duplicates[image_hash] = representative
+                        del missing[image_hash]
+                        self.memo_stats['dedupe_hits'] += 1
+                        break
+                else:
+                    representatives.append((perceptual_hash, image_hash))
+        
+        self.memo_stats['caption_misses'] += len(missing)
         try:
-            # 首先进行卦象分析
-            hexagram_analysis = self.analyze_hexagram(image_path)
-            
-            # 使用BLIP生成基础描述
-            image = Image.open(image_path)
-            inputs = self.processor(
-                image, 
-                return_tensors="pt"
-            ).to(self.device)
-            
+            descriptions = self.describe_images(list(missing.values()))
+        except Exception as e:
+            self.logger.error(f"生成图片描述失败: {str(e)}")
+            return captions
+        self._description_memo.update(zip(missing.keys(), descriptions))
+        for image_hash, representative in duplicates.items():
+            self._description_memo[image_hash] = self._description_memo[representative]
+        
+        if self.dedupe_index is not None and missing:
+            for image_hash, image in missing.items():
+                self.dedupe_index.add(self.dedupe_index.hash(image), self._description_memo[image_hash])
+        
+        # 合并两种描述
+        for (index, _), analysis, image_hash in zip(loaded, analyses, hashes):
+            captions[index] = f"{analysis}\n基础图像描述：{self._description_memo[image_hash]}"
+        
+        return captions
+    
+    def describe_images(self, images):
+        """BLIP批量推理，显存不足时自动减半批大小重试"""
+        if not images:
+            return []
+        self._load_model()
+        
+        batch_size = self._initial_batch_size()
+        descriptions = []
+        start = 0
+        while start < len(images):
+            batch = images[start:start + batch_size]
+            try:
+                descriptions.extend(self._describe_batch(batch))
+                start += len(batch)
+            except RuntimeError as e:
+                if 'out of memory' not in str(e).lower() or batch_size == 1:
+                    raise
+                batch_size = max(1, batch_size // 2)
+                self.logger.warning(f"BLIP推理内存不足，批大小降为 {batch_size}")
+                if self.device.type == 'cuda':
+                    import torch
+                    torch.cuda.empty_cache()
+        
+        return descriptions
+    
+    def _initial_batch_size(self):
+        """根据配置和可用显存确定初始批大小"""
+        settings = self.config['image_captioning']
+        batch_size = max(1, settings.get('batch_size', 8))
+        if self.device.type == 'cuda':
+            import torch
+            free_bytes, _ = torch.cuda.mem_get_info(self.device)
+            per_image = settings.get('memory_per_image_mb', 300) * 1024 * 1024
+            batch_size = max(1, min(batch_size, int(free_bytes // per_image)))
+        return batch_size
+    
+    def _describe_batch(self, images):
+        """对一批图片执行一次BLIP生成"""
+        import torch
+        # BLIP处理器会把图片缩放到统一尺寸后堆叠成一个批次
+        inputs = self.processor(
+            images=[self.to_pil_image(image) for image in images],
+            return_tensors="pt"
+        ).to(self.device)
+        
+        with torch.inference_mode():
             output = self.model.generate(
                 **inputs,
                 max_length=self.config['image_captioning']['max_length']
             )
-            
-            blip_description = self.processor.decode(output[0], skip_special_tokens=True)
-            
-            # 合并两种描述
-            combined_description = f"{hexagram_analysis}\n基础图像描述：{blip_description}"
-            
-            return combined_description
-            
-        except Exception as e:
-            self.logger.error(f"生成图片描述失败: {str(e)}")
-            return "图片描述生成失败"
\ No newline at end of file
+        
+        return [self.processor.decode(ids, skip_special_tokens=True) for ids in output]
@@ -2,12 +2,15 @@ import argparse
 import yaml
 from pathlib import Path
 from pdf_processor import PDFProcessor
-from image_captioner import ImageCaptioner
 from text_cleaner import TextCleaner
-from text_corrector import TextCorrector
 from data_formatter import DataFormatter
+from checkpoint import CheckpointStore
+from pipeline import PipelineExecutor, PipelineStage
 import logging
 
+# 页面处理阶段，按执行顺序排列
+STAGES = ['ocr', 'hexagram', 'clean', 'correct', 'caption']
+
 def setup_logging():
     logging.basicConfig(
         level=logging.INFO,
@@ -15,26 +18,227 @@ def setup_logging():
     )
     return logging.getLogger(__name__)
 
-def process_hexagrams(raw_data, image_captioner):
-    """处理所有检测到的卦象图案"""
-    logger = logging.getLogger(__name__)
-    logger.info("开始分析卦象图案...")
+def image_source(image):
+    """优先使用内存中的ROI，没有时读取保存的图片文件"""
+    return image['roi'] if 'roi' in image else image.get('path')
+
+def caption_images(images, image_captioner):
+    """批量生成一组图片的描述"""
+    images = [image for image in images if image_source(image) is not None]
+    if not images:
+        return
+    captions = image_captioner.generate_captions(
+        [image_source(image) for image in images],
+        [image.get('text') for image in images]
+    )
+    for image, caption in zip(images, captions):
+        image['caption'] = caption
+
+def release_rois(page):
+    """释放ROI，避免整页图像随结果一直驻留内存"""
+    for image in page.get('images', []):
+        image.pop('roi', None)
+
+def process_page_hexagrams(page, image_captioner):
+    """分析单页中检测到的卦象图案，完整描述在描述阶段批量生成"""
+    for image in page.get('images', []):
+        if image_source(image) is not None:
+            # 分析卦象图案
+            image['analysis'] = image_captioner.analyze_hexagram(image_source(image), image.get('text'))
+            decoded = image_captioner.decode_hexagram(image_source(image))
+            if decoded is not None:
+                image['hexagram'] = decoded
+    
+    return page
+
+def caption_pages(pages, image_captioner, checkpoints):
+    """跨页收集图片统一生成描述，恢复运行时已完成描述的页面不再重复处理"""
+    to_caption = [page for page in pages if 'caption' not in page['stages']]
+    caption_images([image for page in to_caption for image in page.get('images', [])], image_captioner)
+    for page in to_caption:
+        release_rois(page)
+        page['stages'].append('caption')
+        checkpoints.save('caption', page)
+    return pages
+
+def correct_page(page, config, text_corrector):
+    """AI校正单页文本"""
+    if config['text_correction']['enable'] and text_corrector is not None:
+        page['text'] = text_corrector.correct_page(page)
+    return page
+
+def usable_image(image):
+    """子图能否交给卦象和描述阶段：内存中有ROI，或保存的图片文件存在"""
+    return 'roi' in image or bool(image.get('path')) and Path(image['path']).exists()
+
+def missing_images(page, stages):
+    """页面还要执行卦象或描述阶段，但部分子图已无法读取（如 save_images 为 false 时的检查点）"""
+    pending = any(name in stages and name not in page['stages'] for name in ('hexagram', 'caption'))
+    return pending and not all(usable_image(image) for image in page.get('images', []))
+
+def iter_ocr_pages(pdf_processor, pdf_path, stages, checkpoints):
+    """逐页产出OCR结果，已有检查点的页面从最后完成的阶段恢复
+
+    检查点在产出该页时才读取；检查点损坏或待处理的子图无法读取的页面重新渲染和识别
+    """
+    page_count = pdf_processor.get_page_count(pdf_path)
+    image_dir = checkpoints.run_dir / 'images'
+    selected = ['ocr'] + [name for name in STAGES[1:] if name in stages]
+    restorable = {
+        page_number for page_number in range(1, page_count + 1)
+        if any(checkpoints.has(name, page_number) for name in selected)
+    }
+    fresh_pages = pdf_processor.iter_pages(pdf_path, skip_pages=restorable, image_dir=image_dir)
+    
+    for page_number in range(1, page_count + 1):
+        if page_number not in restorable:
+            page = next(fresh_pages)
+        else:
+            page = restore_page(page_number, stages, checkpoints)
+            if page is None or missing_images(page, stages):
+                rendered = pdf_processor.rasterize_and_process(pdf_path, page_number, image_dir)
+                if page is not None and len(page.get('images', [])) == len(rendered['images']):
+                    # 沿用检查点中的处理结果，只补回无法读取的子图
+                    for image, source in zip(page['images'], rendered['images']):
+                        image.update((key, source[key]) for key in ('roi', 'path') if key in source)
+                else:
+                    page = rendered
+        # 图片写完后再保存检查点和交给后续阶段，避免检查点引用尚未写出的文件
+        pdf_processor.wait_for_image_writes(page_number)
+        if 'stages' not in page:
+            page['stages'] = ['ocr']
+            checkpoints.save('ocr', page)
+        yield page
     
-    for page in raw_data:
-        for image in page.get('images', []):
-            if 'path' in image:
-                # 分析卦象图案
-                image['analysis'] = image_captioner.analyze_hexagram(image['path'])
-                # 生成完整描述
-                image['caption'] = image_captioner.generate_caption(image['path'])
-                
-    return raw_data
+    # 让生成器执行收尾的统计和图片写出
+    next(fresh_pages, None)
+    pdf_processor.wait_for_image_writes()
+
+def parse_stages(value):
+    """解析 --stages 参数"""
+    stages = [stage.strip() for stage in value.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"未知的阶段: {', '.join(unknown)}，可选: {','.join(STAGES)}")
+    if 'ocr' not in stages:
+        raise argparse.ArgumentTypeError("ocr 阶段不能省略")
+    return stages
+
+def build_components(config_path, config, stages):
+    """只初始化所选阶段需要的组件"""
+    components = {
+        'pdf_processor': PDFProcessor(config_path, config),
+        'text_cleaner': TextCleaner(config) if 'clean' in stages else None,
+        'image_captioner': None,
+        'text_corrector': None,
+        'data_formatter': DataFormatter(config),
+    }
+    if 'hexagram' in stages or 'caption' in stages:
+        from image_captioner import ImageCaptioner
+        components['image_captioner'] = ImageCaptioner(config)
+    if 'correct' in stages and config['text_correction']['enable']:
+        from text_corrector import TextCorrector
+        components['text_corrector'] = TextCorrector(config)
+    return components
+
+def strip_boilerplate(pages, text_cleaner):
+    """跨页识别并删除一批页面中的页眉页脚
+
+    已完成清理阶段的恢复页面删除过页眉页脚，不参与统计，原样返回
+    """
+    text_cleaner.remove_boilerplate([page for page in pages if 'clean' not in page['stages']])
+    return pages
+
+def restore_page(page_number, stages, checkpoints):
+    """读取所选阶段中最后写入的检查点，page['stages'] 记录其中实际完成的阶段；没有可用的检查点时返回None"""
+    selected = ['ocr'] + [name for name in STAGES[1:] if name in stages]
+    latest = checkpoints.load_latest(selected, page_number)
+    if latest is None:
+        return None
+    name, page = latest
+    # 旧版本的检查点没有记录已完成的阶段，按阶段顺序推断
+    page.setdefault('stages', STAGES[:STAGES.index(name) + 1])
+    return page
+
+def checkpointed(name, function, checkpoints):
+    """包装单页阶段：页面已完成的阶段直接跳过，完成后记录阶段并保存检查点"""
+    def run(page):
+        if name in page['stages']:
+            return page
+        page = function(page)
+        page['stages'].append(name)
+        checkpoints.save(name, page)
+        return page
+    return run
+
+def build_pipeline(config, components, stages, checkpoints):
+    """按所选阶段组装流水线，各阶段之间通过有界队列并发执行"""
+    settings = config.get('pipeline', {})
+    workers = settings.get('workers', {})
+    image_captioner = components['image_captioner']
+    data_formatter = components['data_formatter']
+    
+    page_functions = {
+        'hexagram': lambda page: process_page_hexagrams(page, image_captioner),
+        'clean': components['text_cleaner'].process_page_data if components['text_cleaner'] else None,
+        'correct': lambda page: correct_page(page, config, components['text_corrector']),
+    }
+    
+    pipeline_stages = []
+    for name in STAGES[1:]:
+        if name not in stages:
+            continue
+        boilerplate = config.get('text_cleaning', {}).get('boilerplate', {})
+        if name == 'clean' and boilerplate.get('enable', True):
+            # 页眉页脚需要跨页统计：凑满一个窗口的页面后统一删除，窗口内的页面计入流水线中的页数
+            pipeline_stages.append(PipelineStage(
+                'boilerplate',
+                lambda pages: strip_boilerplate(pages, components['text_cleaner']),
+                batch_size=boilerplate.get('window_pages', 8),
+                batch_timeout=None
+            ))
+        if name == 'caption':
+            # 描述阶段一次取出已就绪的多页，合并为一批BLIP推理
+            pipeline_stages.append(PipelineStage(
+                name,
+                lambda pages: caption_pages(pages, image_captioner, checkpoints),
+                workers=workers.get(name, 1),
+                # batch_size为图片数：跨页收集图片，凑满一批或等待超时后再推理
+                batch_size=config['image_captioning'].get('batch_size', 8),
+                batch_timeout=settings.get('caption_batch_timeout', 1.0),
+                batch_weight=lambda page: sum(1 for image in page.get('images', []) if image_source(image) is not None)
+            ))
+        else:
+            pipeline_stages.append(PipelineStage(
+                name, checkpointed(name, page_functions[name], checkpoints),
+                workers=workers.get(name, 1)
+            ))
+    
+    def format_page(page):
+        # 不执行描述阶段时ROI在此释放
+        release_rois(page)
+        return page, data_formatter.format_page(page)
+    
+    pipeline_stages.append(PipelineStage('format', format_page, workers=workers.get('format', 1)))
+    
+    return PipelineExecutor(
+        pipeline_stages,
+        queue_size=settings.get('queue_size', 4),
+        source_name='ocr',
+        source_workers=config['pdf_processing'].get('workers', 1)
+    )
 
 def main():
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='PDF内容提取与处理工具')
     parser.add_argument('pdf_path', help='PDF文件路径')
     parser.add_argument('--config', default='config/config.yaml', help='配置文件路径')
+    parser.add_argument('--run-dir', help='检查点目录，默认为 output_dir/runs/<PDF文件名>')
+    parser.add_argument('--resume', action='store_true', help='从上次中断处继续，跳过已完成的页面和阶段')
+    parser.add_argument(
+        '--stages', type=parse_stages, default=STAGES,
+        help=f"要执行的阶段，逗号分隔，默认全部: {','.join(STAGES)}；纯文本任务可用 ocr,clean,correct"
+    )
     args = parser.parse_args()
     
     logger = setup_logging()
@@ -44,40 +248,90 @@ def main():
         with open(args.config, 'r', encoding='utf-8') as f:
             config = yaml.safe_load(f)
         
-        # 初始化各个组件
-        pdf_processor = PDFProcessor(args.config)
-        image_captioner = ImageCaptioner(config)
-        text_cleaner = TextCleaner()
-        text_corrector = TextCorrector(config)
-        data_formatter = DataFormatter(config)
+        # 初始化各个组件，模型在第一页到达对应阶段时才加载
+        components = build_components(args.config, config, args.stages)
+        pdf_processor = components['pdf_processor']
         
-        # 处理PDF
-        logger.info("开始处理PDF文件...")
-        raw_data = pdf_processor.extract_images_and_text(args.pdf_path)
+        run_dir = args.run_dir or (
+            Path(config['output']['output_dir']) / 'runs' / Path(args.pdf_path).stem
+        )
+        checkpoints = CheckpointStore(run_dir, STAGES, resume=args.resume)
         
-        # 处理卦象图案
-        raw_data = process_hexagrams(raw_data, image_captioner)
+        # 流水线处理PDF：OCR产出的页面依次流经后续各阶段，各阶段同时处理不同页面
+        logger.info(f"开始处理PDF文件，执行阶段: {','.join(args.stages)}")
+        executor = build_pipeline(config, components, args.stages, checkpoints)
+        pages = iter_ocr_pages(pdf_processor, args.pdf_path, args.stages, checkpoints)
+        text_cleaner = components['text_cleaner']
         
-        # 清理文本
-        logger.info("清理提取的文本...")
-        cleaned_data = text_cleaner.process_document(raw_data)
+        page_count = 0
+        training_data = []
+        for page, formatted in executor.run(pages):
+            logger.info(f"第 {page['page_number']} 页处理完成")
+            page_count += 1
+            training_data.extend(formatted)
         
-        # AI校正文本
-        if config['text_correction']['enable']:
-            logger.info("开始AI文本校正...")
-            for page in cleaned_data:
-                page['text'] = text_corrector.correct_text(page['text'])
+        pipeline_metrics = executor.metrics()
+        for name, metrics in pipeline_metrics['stages'].items():
+            logger.info(
+                f"阶段 {name}: {metrics['items']} 页, {metrics['workers']} 个工作线程, "
+                f"利用率 {metrics['utilization']:.1%}, 等待上游 {metrics['starved_s']:.1f}s, "
+                f"等待下游 {metrics['blocked_s']:.1f}s"
+            )
         
-        # 处理图片描述
-        logger.info("生成图片描述...")
-        for page in cleaned_data:
-            for image in page.get('images', []):
-                if 'path' in image:
-                    image['caption'] = image_captioner.generate_caption(image['path'])
+        # 汇总运行报告
+        report = {
+            'stages': args.stages,
+            'pages': page_count,
+            'pdf_processing': pdf_processor.stats,
+            'pipeline': pipeline_metrics,
+            'checkpoints_reused': checkpoints.reused,
+        }
+        if text_cleaner is not None:
+            stats = text_cleaner.boilerplate_stats
+            report['text_cleaning'] = dict(
+                stats, removed_ratio=stats['chars_removed'] / stats['chars_before'] if stats['chars_before'] else 0.0
+            )
+            logger.info(
+                f"删除页眉页脚等重复行 {stats['lines_removed']} 行，共 {stats['chars_removed']} 个字符"
+                f"（占 {report['text_cleaning']['removed_ratio']:.1%}）"
+            )
+        if checkpoints.reused:
+            logger.info(f"复用检查点: {checkpoints.reused}")
+        if components['image_captioner'] is not None:
+            image_captioner = components['image_captioner']
+            # 感知哈希索引只在运行结束时写回一次
+            if image_captioner.dedupe_index is not None:
+                image_captioner.dedupe_index.save()
+            memo_stats = image_captioner.memo_stats
+            report['image_captioning'] = dict(memo_stats, dedupe_ratio=image_captioner.dedupe_ratio())
+            logger.info(
+                f"图片分析: 计算 {memo_stats['analysis_misses']} 次, 复用 {memo_stats['analysis_hits']} 次; "
+                f"BLIP描述: 生成 {memo_stats['caption_misses']} 次, 复用 {memo_stats['caption_hits']} 次, "
+                f"近似去重 {memo_stats['dedupe_hits']} 次, 去重率 {image_captioner.dedupe_ratio():.1%}"
+            )
+        if components['text_corrector'] is not None:
+            text_corrector = components['text_corrector']
+            stats = text_corrector.stats
+            report['text_correction'] = dict(
+                stats, sent_ratio=stats['chars_sent'] / stats['chars_total'] if stats['chars_total'] else 0.0
+            )
+            logger.info(
+                f"文本校正: 送入大模型 {stats['chars_sent']}/{stats['chars_total']} 个字符"
+                f"（{report['text_correction']['sent_ratio']:.1%}），跳过 {stats['pages_skipped']} 页"
+            )
+            if text_corrector.cache is not None:
+                cache_counters = text_corrector.cache.counters()
+                report['text_correction']['cache'] = cache_counters
+                logger.info(
+                    f"校正缓存: 命中 {cache_counters['hits']} 次, 命中率 {cache_counters['hit_rate']:.1%}, "
+                    f"节省令牌 {cache_counters['saved_prompt_tokens'] + cache_counters['saved_completion_tokens']}"
+                )
+            text_corrector.close()
+        checkpoints.save_report(report)
         
         # 保存处理后的数据
         logger.info("保存处理结果...")
-        data_formatter.save_training_data(cleaned_data)
+        components['data_formatter'].format_to_json(training_data, 'training_data.json')
         
         logger.info("处理完成！")
         
@@ -86,4 +340,4 @@ def main():
         raise
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,191 @@
+import re
+import logging
+from typing import Dict, List
+from PIL import Image
+
+class PytesseractBackend:
+    """通过pytesseract调用tesseract命令行，每次识别都会启动新进程"""
+
+    name = 'pytesseract'
+
+    def __init__(self, language: str, ocr_config: str = '', tesseract_cmd: str = None):
+        import pytesseract
+        self.pytesseract = pytesseract
+        if tesseract_cmd:
+            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+        self.language = language
+        self.ocr_config = ocr_config
+
+    def image_to_string(self, image) -> str:
+        return self.pytesseract.image_to_string(image, lang=self.language, config=self.ocr_config)
+
+    def image_to_data(self, image) -> List[Dict]:
+        """一次版面分析，返回带位置和置信度的单词列表"""
+        data = self.pytesseract.image_to_data(
+            image, lang=self.language, config=self.ocr_config,
+            output_type=self.pytesseract.Output.DICT
+        )
+        words = []
+        for i, text in enumerate(data['text']):
+            if data['level'][i] != 5 or not text.strip():
+                continue
+            words.append({
+                'text': text.strip(),
+                'left': data['left'][i],
+                'top': data['top'][i],
+                'width': data['width'][i],
+                'height': data['height'][i],
+                'conf': float(data['conf'][i]),
+                'block': data['block_num'][i],
+                'par': data['par_num'][i],
+                'line': data['line_num'][i]
+            })
+        return words
+
+    def close(self) -> None:
+        pass
+
+class TesserocrBackend:
+    """通过tesserocr在进程内调用tesseract，语言数据只在初始化时加载一次"""
+
+    name = 'tesserocr'
+
+    def __init__(self, language: str, ocr_config: str = '', tessdata_path: str = None):
+        import tesserocr
+        options = {'lang': language}
+        if tessdata_path:
+            options['path'] = tessdata_path
+        # 沿用命令行参数中的 --psm / --oem 设置
+        psm = re.search(r'--psm\s+(\d+)', ocr_config)
+        if psm:
+            options['psm'] = int(psm.group(1))
+        oem = re.search(r'--oem\s+(\d+)', ocr_config)
+        if oem:
+            options['oem'] = int(oem.group(1))
+        self.api = tesserocr.PyTessBaseAPI(**options)
+        self.language = language
+        self.ocr_config = ocr_config
+
+    def image_to_string(self, image) -> str:
+        self.api.SetImage(_to_pil(image))
+        return self.api.GetUTF8Text()
+
+    def image_to_data(self, image) -> List[Dict]:
+        """一次版面分析，返回带位置和置信度的单词列表"""
+        from tesserocr import RIL, iterate_level
+        self.api.SetImage(_to_pil(image))
+        self.api.Recognize()
+
+        words = []
+        block = par = line = 0
+        for item in iterate_level(self.api.GetIterator(), RIL.WORD):
+            # 与tesseract TSV输出保持一致的块/段落/行编号
+            if item.IsAtBeginningOf(RIL.BLOCK):
+                block, par, line = block + 1, 0, 0
+            if item.IsAtBeginningOf(RIL.PARA):
+                par, line = par + 1, 0
+            if item.IsAtBeginningOf(RIL.TEXTLINE):
+                line += 1
+
+            text = item.GetUTF8Text(RIL.WORD)
+            box = item.BoundingBox(RIL.WORD)
+            if not text or not text.strip() or box is None:
+                continue
+            x1, y1, x2, y2 = box
+            words.append({
+                'text': text.strip(),
+                'left': x1,
+                'top': y1,
+                'width': x2 - x1,
+                'height': y2 - y1,
+                'conf': float(item.Confidence(RIL.WORD)),
+                'block': block,
+                'par': par,
+                'line': line
+            })
+        return words
+
+    def close(self) -> None:
+        self.api.End()
+
+def _is_cjk(ch: str) -> bool:
+    return '\u3000' <= ch <= '\u9fff' or '\uff00' <= ch <= '\uffef'
+
+def _join_words(words: List[Dict]) -> str:
+    """拼接同一行的单词，中文字符之间不插入空格"""
+    line = ''
+    for word in words:
+        text = word['text']
+        if line and not (_is_cjk(line[-1]) and _is_cjk(text[0])):
+            line += ' '
+        line += text
+    return line
+
+def _group_lines(words: List[Dict]) -> List[tuple]:
+    """按块、段落和行分组，返回 [(行键, 单词列表)]"""
+    lines = []
+    current_key = None
+    current_words = []
+    for word in words:
+        key = (word['block'], word['par'], word['line'])
+        if key != current_key and current_words:
+            lines.append((current_key, current_words))
+            current_words = []
+        current_key = key
+        current_words.append(word)
+    if current_words:
+        lines.append((current_key, current_words))
+    return lines
+
+def words_to_text(words: List[Dict]) -> str:
+    """按块、段落和行将版面分析结果还原为文本"""
+    # 段落之间保留空行
+    text = ''
+    previous_key = None
+    for key, line_words in _group_lines(words):
+        if previous_key is not None:
+            text += '\n\n' if key[:2] != previous_key[:2] else '\n'
+        text += _join_words(line_words)
+        previous_key = key
+    return text
+
+def words_to_lines(words: List[Dict]) -> List[List]:
+    """按行保留单词文本和置信度，供校正阶段定位低置信度片段：[[[单词, 置信度], ...], ...]"""
+    return [
+        [[word['text'], round(word['conf'], 1)] for word in line_words]
+        for _, line_words in _group_lines(words)
+    ]
+
+def words_in_box(words: List[Dict], position: Dict) -> List[Dict]:
+    """选出中心点落在指定区域内的单词"""
+    x, y = position['x'], position['y']
+    w, h = position['width'], position['height']
+    selected = []
+    for word in words:
+        cx = word['left'] + word['width'] / 2
+        cy = word['top'] + word['height'] / 2
+        if x <= cx <= x + w and y <= cy <= y + h:
+            selected.append(word)
+    return selected
+
+def _to_pil(image):
+    """将OpenCV的BGR数组转换为PIL图像"""
+    if isinstance(image, Image.Image):
+        return image
+    if image.ndim == 3:
+        image = image[:, :, ::-1]
+    return Image.fromarray(image)
+
+def create_ocr_backend(settings: Dict, ocr_config: str = ''):
+    """根据 pdf_processing 配置创建OCR后端，tesserocr不可用时回退到pytesseract"""
+    logger = logging.getLogger(__name__)
+    language = settings.get('language', 'chi_sim+eng')
+    backend = settings.get('ocr_backend', 'pytesseract')
+
+    if backend == 'tesserocr':
+        try:
+            return TesserocrBackend(language, ocr_config, settings.get('tessdata_path'))
+        except Exception as e:
+            logger.warning(f"tesserocr后端初始化失败，回退到pytesseract: {str(e)}")
+
+    return PytesseractBackend(language, ocr_config, settings.get('tesseract_path'))
@@ -0,0 +1,87 @@
+import hashlib
+import sqlite3
+import time
+import logging
+from pathlib import Path
+from typing import Dict, Optional
+
+class OCRCache:
+    """基于SQLite的OCR结果缓存，按PDF文件内容、页码和处理参数寻址，超出容量时按LRU淘汰"""
+
+    def __init__(self, db_path, max_size_mb: float = 512):
+        self.logger = logging.getLogger(__name__)
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # 多个OCR进程可能同时读写同一个缓存文件
+        self.conn = sqlite3.connect(str(self.db_path), timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+            'size INTEGER NOT NULL, last_access REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_last_access ON entries(last_access)')
+        self.conn.commit()
+
+    @staticmethod
+    def make_page_key(pdf_digest: str, page_number: int, **params) -> str:
+        """由PDF文件哈希、页码和栅格化、预处理、OCR参数生成整页缓存键，查询时无需先栅格化页面"""
+        digest = hashlib.sha256(f"{pdf_digest}:{page_number}".encode('utf-8'))
+        for name in sorted(params):
+            digest.update(f"|{name}={params[name]}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存，命中时刷新访问时间"""
+        row = self.conn.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+        self.conn.commit()
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        """写入缓存并按容量淘汰最久未使用的条目"""
+        size = len(value.encode('utf-8'))
+        self.conn.execute(
+            'INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)',
+            (key, value, size, time.time())
+        )
+        self._evict()
+        self.conn.commit()
+
+    def _evict(self) -> None:
+        """删除最久未使用的条目直到总大小不超过上限"""
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        rows = self.conn.execute('SELECT key, size FROM entries ORDER BY last_access').fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+            self.evictions += 1
+
+    def counters(self) -> Dict[str, int]:
+        """返回命中、未命中和淘汰计数"""
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def merge(self, counters: Dict[str, int]) -> None:
+        """合并其他进程中的计数"""
+        self.hits += counters.get('hits', 0)
+        self.misses += counters.get('misses', 0)
+        self.evictions += counters.get('evictions', 0)
+
+    def close(self) -> None:
+        self.conn.close()
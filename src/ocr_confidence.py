@@ -0,0 +1,69 @@
+from typing import List
+
+def _normalize(text: str) -> tuple:
+    """去掉空白字符，返回 (归一化文本, 每个字符在原文中的位置)"""
+    positions = [index for index, ch in enumerate(text) if not ch.isspace()]
+    return ''.join(text[index] for index in positions), positions
+
+def low_confidence_mask(text: str, ocr_lines: List[List], threshold: float, lookahead: int = 3) -> List[bool]:
+    """标记文本中由低置信度单词构成的字符
+
+    清理阶段只会删除整行（页码、页眉页脚）或调整空白，因此按行顺序对齐：
+    OCR行去掉空白后与当前文本的某一行相同即视为对应，找不到的行视为已被删除
+    """
+    mask = [False] * len(text)
+    line_starts = [0]
+    for index, ch in enumerate(text):
+        if ch == '\n':
+            line_starts.append(index + 1)
+    text_lines = text.split('\n')
+    normalized_lines = [_normalize(line) for line in text_lines]
+
+    cursor = 0
+    for words in ocr_lines:
+        ocr_line = ''.join(word for word, _ in words)
+        ocr_line = ''.join(ocr_line.split())
+        if not ocr_line:
+            continue
+        match = None
+        for index in range(cursor, min(cursor + lookahead, len(text_lines))):
+            if normalized_lines[index][0] == ocr_line:
+                match = index
+                break
+        if match is None:
+            continue
+        cursor = match + 1
+
+        # 行内按单词顺序定位，低置信度单词覆盖的字符标记为可疑
+        _, positions = normalized_lines[match]
+        offset = 0
+        for word, conf in words:
+            length = len(''.join(word.split()))
+            if conf < threshold:
+                for position in positions[offset:offset + length]:
+                    mask[line_starts[match] + position] = True
+            offset += length
+    return mask
+
+def suspicious_windows(text: str, mask: List[bool], context: int = 20) -> List[tuple]:
+    """将可疑字符向两侧扩展若干上下文字符（不跨行），重叠的窗口合并，返回 [(start, end)]"""
+    windows = []
+    index = 0
+    while index < len(mask):
+        if not mask[index]:
+            index += 1
+            continue
+        end = index
+        while end < len(mask) and mask[end]:
+            end += 1
+        line_start = text.rfind('\n', 0, index) + 1
+        line_end = text.find('\n', end)
+        line_end = len(text) if line_end == -1 else line_end
+        start = max(line_start, index - context)
+        stop = min(line_end, end + context)
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], stop))
+        else:
+            windows.append((start, stop))
+        index = end
+    return windows
@@ -1,17 +1,55 @@
 import PyPDF2
-from pdf2image import convert_from_path
+import os
+import json
+import hashlib
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from pdf2image import convert_from_path, pdfinfo_from_path
 import pytesseract
 from pathlib import Path
 import yaml
 import logging
 from PIL import Image
+from ocr_cache import OCRCache
+from ocr_backend import create_ocr_backend, words_to_text, words_to_lines, words_in_box
+
+# 工作进程中的处理器实例，由 _init_worker 创建
+_worker_processor = None
+
+def _init_worker(config_path, threads_per_worker):
+    """初始化OCR工作进程，限制各库线程数避免超额占用CPU"""
+    global _worker_processor
+    for var in ('OMP_THREAD_LIMIT', 'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[var] = str(threads_per_worker)
+    
+    import cv2
+    cv2.setNumThreads(threads_per_worker)
+    
+    _worker_processor = PDFProcessor(config_path)
+
+def _process_page_in_worker(pdf_path, page_number, image_dir):
+    """在工作进程中栅格化并处理单页，同时返回本页的缓存计数"""
+    cache = _worker_processor.ocr_cache
+    before = cache.counters() if cache else {}
+    page_data = _worker_processor.rasterize_and_process(pdf_path, page_number, image_dir)
+    # 图片写完再返回，主进程保存检查点时图片文件已经存在
+    _worker_processor.wait_for_image_writes()
+    after = cache.counters() if cache else {}
+    return page_data, {name: after[name] - before[name] for name in after}
 
 class PDFProcessor:
-    def __init__(self, config_path):
-        with open(config_path, 'r', encoding='utf-8') as f:
-            self.config = yaml.safe_load(f)
+    def __init__(self, config_path, config=None):
+        self.config_path = config_path
+        # 调用方已加载配置时直接复用，避免重复解析YAML
+        if config is None:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = yaml.safe_load(f)
+        self.config = config
         
         self.setup_logging()
+        self.stats = {}
         # 增加OCR配置选项
         self.ocr_config = '--oem 3 --psm 3'  # 使用更准确的OCR引擎模式
         
@@ -22,6 +60,33 @@ class PDFProcessor:
         
         # 设置Tesseract路径
         pytesseract.pytesseract.tesseract_cmd = self.config['pdf_processing']['tesseract_path']
+        
+        # OCR后端在每个进程中只初始化一次
+        self.ocr_backend = create_ocr_backend(self.config['pdf_processing'], self.ocr_config)
+        
+        self.ocr_cache = self._open_ocr_cache()
+        # PDF文件内容哈希，整页缓存键的一部分，每个文件只计算一次
+        self._pdf_digests = {}
+        
+        # 按配置构建图像预处理流水线，并累计每个步骤的耗时（毫秒）
+        self.preprocessing_steps = self.build_preprocessing_pipeline(
+            self.config['pdf_processing'].get('preprocessing', {})
+        )
+        self.preprocess_timings = {}
+        
+        # 图片写出在后台线程中进行
+        self._image_writer = None
+        self._pending_writes = []
+    
+    def _open_ocr_cache(self):
+        """打开OCR结果缓存，未启用时返回None"""
+        cache_config = self.config['pdf_processing'].get('ocr_cache', {})
+        if not cache_config.get('enable', True):
+            return None
+        cache_path = cache_config.get('path') or (
+            Path(self.config['output']['output_dir']) / 'ocr_cache.sqlite'
+        )
+        return OCRCache(cache_path, cache_config.get('max_size_mb', 512))
     
     def setup_logging(self):
         logging.basicConfig(
@@ -32,67 +97,386 @@ class PDFProcessor:
     
     def extract_images_and_text(self, pdf_path):
         """提取PDF中的图片和文本"""
+        return list(self.iter_pages(pdf_path))
+
+    def get_page_count(self, pdf_path):
+        """获取PDF总页数"""
+        return pdfinfo_from_path(pdf_path)['Pages']
+
+    def default_image_dir(self, pdf_path) -> Path:
+        """页面图片和卦象子图的默认保存目录，按PDF文件名区分，多本书共用output_dir时不会互相覆盖"""
+        return Path(self.config['output']['output_dir']) / 'runs' / Path(pdf_path).stem / 'images'
+    
+    def iter_pages(self, pdf_path, skip_pages=None, image_dir=None):
+        """流式提取PDF，按页码顺序逐页产出处理结果，skip_pages中的页面不处理"""
         self.logger.info(f"开始处理PDF: {pdf_path}")
         
-        # 转换PDF页面为图片
-        images = convert_from_path(
-            pdf_path,
-            dpi=self.config['pdf_processing']['dpi']
+        image_dir = Path(image_dir) if image_dir else self.default_image_dir(pdf_path)
+        if self.config['output'].get('save_images', True):
+            image_dir.mkdir(parents=True, exist_ok=True)
+        
+        page_count = self.get_page_count(pdf_path)
+        skip_pages = skip_pages or set()
+        page_numbers = [n for n in range(1, page_count + 1) if n not in skip_pages]
+        if skip_pages:
+            self.logger.info(f"跳过已完成的 {page_count - len(page_numbers)} 页")
+        
+        reader = self._open_text_layer(pdf_path)
+        workers = self.config['pdf_processing'].get('workers', 1)
+        if workers > 1:
+            pages = self._iter_pages_parallel(pdf_path, page_numbers, workers, reader, image_dir)
+        else:
+            pages = self._iter_pages_serial(pdf_path, page_numbers, reader, image_dir)
+        
+        start_time = time.perf_counter()
+        processed = 0
+        layer_pages = 0
+        for page_data in pages:
+            processed += 1
+            if page_data['text_source'] == 'layer':
+                layer_pages += 1
+            yield page_data
+        self.wait_for_image_writes()
+        
+        # 记录吞吐量，用于评估节点规格
+        elapsed = time.perf_counter() - start_time
+        self.stats = {
+            'pages': processed,
+            'layer_pages': layer_pages,
+            'ocr_pages': processed - layer_pages,
+            'workers': workers,
+            'seconds': elapsed,
+            'pages_per_sec': processed / elapsed if elapsed > 0 else 0.0
+        }
+        self.logger.info(
+            f"PDF处理完成: {processed} 页 (文本层 {layer_pages} 页), {workers} 个进程, "
+            f"耗时 {elapsed:.1f} 秒, {self.stats['pages_per_sec']:.2f} 页/秒"
         )
+        if self.ocr_cache:
+            self.stats['ocr_cache'] = self.ocr_cache.counters()
+            self.logger.info(f"OCR缓存: 命中 {self.ocr_cache.hits} 次, 未命中 {self.ocr_cache.misses} 次")
+
+    def _iter_pages_serial(self, pdf_path, page_numbers, reader, image_dir):
+        """按页窗口栅格化并串行处理"""
+        # 每次只栅格化一个窗口内的页面，内存占用与文档总页数无关
+        window = max(1, self.config['pdf_processing'].get('page_window', 8))
         
-        results = []
-        for i, image in enumerate(images):
-            # 图像预处理以提高OCR质量
-            processed_image = self.preprocess_image(image)
+        for start in range(0, len(page_numbers), window):
+            window_pages = page_numbers[start:start + window]
             
-            # 检测页面中的卦象图案
-            hexagram_images = self.detect_hexagram_images(processed_image)
-            
-            page_data = {
-                'page_number': i + 1,
-                'text': pytesseract.image_to_string(
-                    processed_image,
-                    lang=self.config['pdf_processing']['language'],
-                    config=self.ocr_config
-                ),
-                'images': hexagram_images
+            # 先探测文本层和整页缓存，只栅格化需要OCR且缓存未命中的页面
+            layer_texts = {
+                page_number: self._probe_text_layer(reader, page_number)
+                for page_number in window_pages
             }
+            lookups = {n: self._lookup_page(pdf_path, n) for n, text in layer_texts.items() if text is None}
+            ocr_pages = [n for n, (_, cached) in lookups.items() if not self._reusable(cached)]
             
-            # 保存页面图片
-            image_path = Path(self.config['output']['output_dir']) / f"page_{i+1}.png"
-            image.save(str(image_path))
+            images = {}
+            for run_first, run_last in self._contiguous_runs(ocr_pages):
+                self.logger.info(f"栅格化页面 {run_first}-{run_last}")
+                # 转换PDF页面为图片
+                run_images = convert_from_path(
+                    pdf_path,
+                    dpi=self.config['pdf_processing']['dpi'],
+                    first_page=run_first,
+                    last_page=run_last
+                )
+                for offset, image in enumerate(run_images):
+                    images[run_first + offset] = image
             
-            results.append(page_data)
+            for page_number in window_pages:
+                if layer_texts[page_number] is not None:
+                    yield self._layer_page(page_number, layer_texts[page_number])
+                elif page_number not in images:
+                    yield lookups[page_number][1]
+                else:
+                    # 处理后立即释放页面图片
+                    cache_key, cached = lookups[page_number]
+                    yield self.process_page(images.pop(page_number), page_number, image_dir, cache_key, cached)
+
+    def _iter_pages_parallel(self, pdf_path, page_numbers, workers, reader, image_dir):
+        """将页面分发到进程池处理，并按页码顺序产出结果"""
+        threads_per_worker = self.config['pdf_processing'].get('threads_per_worker', 1)
+        # 限制在途页面数量，避免结果堆积占用内存
+        max_in_flight = workers * 2
+        
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.config_path, threads_per_worker)
+        ) as executor:
+            pending = deque()
+            remaining = deque(page_numbers)
+            while remaining or pending:
+                while remaining and len(pending) < max_in_flight:
+                    page_number = remaining.popleft()
+                    layer_text = self._probe_text_layer(reader, page_number)
+                    if layer_text is not None:
+                        # 文本层可用的页面无需提交到进程池
+                        future = Future()
+                        future.set_result((self._layer_page(page_number, layer_text), {}))
+                    else:
+                        future = executor.submit(_process_page_in_worker, pdf_path, page_number, image_dir)
+                    pending.append(future)
+                # 按提交顺序取结果，保证页码有序
+                page_data, cache_counters = pending.popleft().result()
+                if self.ocr_cache:
+                    self.ocr_cache.merge(cache_counters)
+                yield page_data
+
+    @staticmethod
+    def _contiguous_runs(page_numbers):
+        """将有序页码列表合并为连续区间"""
+        runs = []
+        for page_number in page_numbers:
+            if runs and runs[-1][1] == page_number - 1:
+                runs[-1][1] = page_number
+            else:
+                runs.append([page_number, page_number])
+        return runs
+
+    def _open_text_layer(self, pdf_path):
+        """打开PDF文本层，未启用或无法读取时返回None"""
+        if not self.config['pdf_processing'].get('text_layer', {}).get('enable', True):
+            return None
+        try:
+            reader = PyPDF2.PdfReader(pdf_path)
+            if reader.is_encrypted:
+                return None
+            return reader
+        except Exception as e:
+            self.logger.warning(f"无法读取PDF文本层，全部页面使用OCR: {str(e)}")
+            return None
+
+    def _probe_text_layer(self, reader, page_number):
+        """提取页面内嵌文本，质量不达标时返回None"""
+        if reader is None:
+            return None
+        try:
+            text = reader.pages[page_number - 1].extract_text() or ''
+        except Exception as e:
+            self.logger.warning(f"第 {page_number} 页文本层提取失败: {str(e)}")
+            return None
+        return text if self._is_usable_text_layer(text) else None
+
+    def _is_usable_text_layer(self, text):
+        """根据长度、中文占比和替换字符比例判断文本层是否可用"""
+        settings = self.config['pdf_processing'].get('text_layer', {})
+        chars = [ch for ch in text if not ch.isspace()]
+        if len(chars) < settings.get('min_chars', 20):
+            return False
+        
+        replacement = sum(1 for ch in chars if ch == '\ufffd')
+        if replacement / len(chars) > settings.get('max_replacement_ratio', 0.01):
+            return False
+        
+        # 中文识别时要求文本层包含足够比例的汉字
+        if 'chi' in self.config['pdf_processing']['language']:
+            cjk = sum(1 for ch in chars if '\u4e00' <= ch <= '\u9fff')
+            if cjk / len(chars) < settings.get('min_cjk_ratio', 0.3):
+                return False
+        
+        return True
+
+    def _layer_page(self, page_number, text):
+        """由文本层构造页面数据，跳过栅格化和OCR"""
+        return {
+            'page_number': page_number,
+            'text': text,
+            'images': [],
+            'text_source': 'layer'
+        }
+
+    def rasterize_and_process(self, pdf_path, page_number, image_dir=None):
+        """栅格化并处理指定页"""
+        cache_key, cached = self._lookup_page(pdf_path, page_number)
+        if self._reusable(cached):
+            return cached
+        image_dir = Path(image_dir) if image_dir else self.default_image_dir(pdf_path)
+        if self.config['output'].get('save_images', True):
+            image_dir.mkdir(parents=True, exist_ok=True)
+        images = convert_from_path(
+            pdf_path,
+            dpi=self.config['pdf_processing']['dpi'],
+            first_page=page_number,
+            last_page=page_number
+        )
+        return self.process_page(images[0], page_number, image_dir, cache_key, cached)
+
+    def _pdf_digest(self, pdf_path):
+        """PDF文件内容的SHA-256，文件大小或修改时间变化时重新计算"""
+        stat = os.stat(pdf_path)
+        key = (str(pdf_path), stat.st_size, stat.st_mtime_ns)
+        if key not in self._pdf_digests:
+            digest = hashlib.sha256()
+            with open(pdf_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            self._pdf_digests[key] = digest.hexdigest()
+        return self._pdf_digests[key]
+
+    def _lookup_page(self, pdf_path, page_number):
+        """按PDF内容、页码和处理参数查询整页缓存，返回 (缓存键, 缓存的页面数据)；未启用缓存时均为None"""
+        if self.ocr_cache is None:
+            return None, None
+        settings = self.config['pdf_processing']
+        cache_key = OCRCache.make_page_key(
+            self._pdf_digest(pdf_path),
+            page_number,
+            dpi=settings['dpi'],
+            preprocessing=json.dumps(settings.get('preprocessing', {}), sort_keys=True),
+            language=settings['language'],
+            ocr_config=self.ocr_config,
+            backend=self.ocr_backend.name,
+            output='page'
+        )
+        cached = self.ocr_cache.get(cache_key)
+        return cache_key, json.loads(cached) if cached is not None else None
+
+    @staticmethod
+    def _reusable(cached):
+        """缓存的页面能否直接使用：子图只保存了路径，文件必须仍然存在"""
+        return cached is not None and all(
+            image.get('path') and Path(image['path']).exists() for image in cached['images']
+        )
+
+    def process_page(self, image, page_number, image_dir, cache_key=None, cached=None):
+        """处理单个页面图片，页面图片和卦象子图保存到image_dir
+
+        cached 为命中但子图文件已不存在的缓存结果：重新检测子图，文字沿用缓存，不再OCR
+        """
+        # 图像预处理以提高OCR质量
+        processed_image = self.preprocess_image(image)
+        
+        # 检测页面中的卦象图案
+        hexagram_images = self.detect_hexagram_images(processed_image, page_number, image_dir)
+        
+        if cached is not None and len(cached['images']) == len(hexagram_images):
+            for hexagram, source in zip(hexagram_images, cached['images']):
+                hexagram['text'] = source.get('text', '')
+            page_data = dict(cached, images=hexagram_images)
+        else:
+            # 整页只做一次版面分析，卦象区域内的文字直接取自页面识别结果
+            words = self.ocr_backend.image_to_data(processed_image)
+            for hexagram in hexagram_images:
+                hexagram['text'] = words_to_text(words_in_box(words, hexagram['position']))
             
-        return results 
+            page_data = {
+                'page_number': page_number,
+                'text': words_to_text(words),
+                'images': hexagram_images,
+                'text_source': 'ocr',
+                # 每行单词的置信度，校正阶段只把低置信度片段送入大模型
+                'ocr_lines': words_to_lines(words)
+            }
+            if cache_key is not None:
+                # 缓存不含ROI，命中时子图从保存的文件读取
+                self.ocr_cache.put(cache_key, json.dumps(dict(page_data, images=[
+                    {key: value for key, value in hexagram.items() if key != 'roi'} for hexagram in hexagram_images
+                ]), ensure_ascii=False))
+        
+        # 保存页面图片
+        if self.config['output'].get('save_images', True):
+            image_path = Path(image_dir) / f"page_{page_number}.png"
+            self._write_async(page_number, image.save, str(image_path))
+        
+        return page_data
+
+    def build_preprocessing_pipeline(self, settings):
+        """根据预处理配置构建步骤列表，每个步骤为 (名称, 函数)"""
+        if not settings.get('enable', True):
+            return []
+        
+        steps = []
+        if settings.get('enhance_contrast', False):
+            steps.append(('enhance_contrast', self._enhance_contrast))
+        
+        if settings.get('denoise', True):
+            method = settings.get('denoise_method', 'median')
+            threshold = settings.get('noise_threshold', 0)
+            steps.append(('denoise', lambda gray: self._denoise(gray, method, threshold)))
+        
+        binarize = settings.get('binarize', 'otsu')
+        if binarize == 'otsu':
+            steps.append(('binarize', self._binarize_otsu))
+        elif binarize == 'adaptive':
+            steps.append(('binarize', self._binarize_adaptive))
+        
+        return steps
 
     def preprocess_image(self, image):
         """图像预处理以提高OCR质量"""
         import cv2
         import numpy as np
         
-        # 转换为OpenCV格式
-        img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        
         # 灰度化
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(np.array(image.convert('RGB')), cv2.COLOR_RGB2GRAY)
         
-        # 二值化
-        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        # 依次执行配置的预处理步骤并记录耗时
+        for name, step in self.preprocessing_steps:
+            start_time = time.perf_counter()
+            gray = step(gray)
+            self.preprocess_timings[name] = (
+                self.preprocess_timings.get(name, 0.0) + (time.perf_counter() - start_time) * 1000
+            )
         
-        # 降噪
-        denoised = cv2.fastNlMeansDenoising(binary)
+        return Image.fromarray(gray)
+
+    def _enhance_contrast(self, gray):
+        """CLAHE局部对比度增强"""
+        import cv2
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        return clahe.apply(gray)
+
+    def _denoise(self, gray, method, threshold):
+        """降噪，噪声估计低于阈值的干净页面直接跳过"""
+        import cv2
+        if threshold > 0 and self.estimate_noise(gray) < threshold:
+            return gray
+        if method == 'nlmeans':
+            return cv2.fastNlMeansDenoising(gray)
+        if method == 'median':
+            return cv2.medianBlur(gray, 3)
+        return gray
+
+    def _binarize_otsu(self, gray):
+        """Otsu全局二值化"""
+        import cv2
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return binary
+
+    def _binarize_adaptive(self, gray):
+        """自适应阈值二值化，适合光照不均的扫描页"""
+        import cv2
+        return cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15
+        )
+
+    @staticmethod
+    def estimate_noise(gray):
+        """快速估计灰度图噪声标准差（Immerkær方法，在降采样图像上计算）"""
+        import cv2
+        import numpy as np
         
-        return Image.fromarray(denoised)
+        small = cv2.resize(gray, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+        h, w = small.shape
+        if h < 3 or w < 3:
+            return 0.0
+        kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+        response = cv2.filter2D(small.astype(np.float32), -1, kernel)
+        return float(np.sqrt(np.pi / 2) * np.abs(response[1:-1, 1:-1]).sum() / (6 * (w - 2) * (h - 2)))
 
-    def detect_hexagram_images(self, image):
-        """检测页面中的卦象图案"""
+    def detect_hexagram_images(self, image, page_number, image_dir):
+        """检测页面中的卦象图案，ROI以numpy视图形式直接交给后续阶段"""
         import cv2
         import numpy as np
         
-        # 转换为OpenCV格式
-        img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # 预处理后的页面为灰度图，直接取数组避免复制
+        gray = np.asarray(image)
+        if gray.ndim == 3:
+            gray = cv2.cvtColor(gray, cv2.COLOR_RGB2GRAY)
         
         # 使用Canny边缘检测
         edges = cv2.Canny(gray, 50, 150)
@@ -101,21 +485,45 @@ class PDFProcessor:
         contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
         hexagram_images = []
-        for i, contour in enumerate(contours):
+        for contour in contours:
             x, y, w, h = cv2.boundingRect(contour)
             
             # 筛选可能的卦象图案（根据尺寸和形状）
             if w > 100 and h > 100 and 0.8 < w/h < 1.2:  # 近似正方形
-                # 提取感兴趣区域
-                roi = img[y:y+h, x:x+w]
+                # 提取感兴趣区域（不复制像素数据）
+                roi = gray[y:y+h, x:x+w]
+                hexagram = {
+                    'roi': roi,
+                    'position': {'x': x, 'y': y, 'width': w, 'height': h}
+                }
                 
-                # 保存子图片
-                output_path = Path(self.config['output']['output_dir']) / f"hexagram_{len(hexagram_images)}.png"
-                cv2.imwrite(str(output_path), roi)
+                # 按需异步保存子图片，目录区分PDF、文件名包含页码，避免跨书和跨页覆盖
+                if self.config['output'].get('save_images', True):
+                    output_path = Path(image_dir) / f"page_{page_number}_hexagram_{len(hexagram_images)}.png"
+                    self._write_async(page_number, cv2.imwrite, str(output_path), roi)
+                    hexagram['path'] = str(output_path)
                 
-                hexagram_images.append({
-                    'path': str(output_path),
-                    'position': {'x': x, 'y': y, 'width': w, 'height': h}
-                })
+                hexagram_images.append(hexagram)
         
-        return hexagram_images
\ No newline at end of file
+        return hexagram_images
+
+    def _write_async(self, page_number, write, *args):
+        """在后台线程中写出图片，不阻塞OCR主流程"""
+        if self._image_writer is None:
+            self._image_writer = ThreadPoolExecutor(max_workers=1)
+        future = self._image_writer.submit(write, *args)
+        future.add_done_callback(self._log_write_error)
+        # 只保留尚未完成的写出任务
+        self._pending_writes = [(n, f) for n, f in self._pending_writes if not f.done()]
+        self._pending_writes.append((page_number, future))
+
+    def _log_write_error(self, future):
+        if future.exception() is not None:
+            self.logger.error(f"保存图片失败: {str(future.exception())}")
+
+    def wait_for_image_writes(self, page_number=None):
+        """等待后台图片写出完成，指定页码时只等待该页的图片"""
+        for n, future in self._pending_writes:
+            if page_number is None or n == page_number:
+                future.exception()
+        self._pending_writes = [(n, f) for n, f in self._pending_writes if not f.done()]
@@ -0,0 +1,97 @@
+import json
+import logging
+from pathlib import Path
+from typing import Optional
+import cv2
+
+def dhash(image, hash_size: int = 16, tolerance: int = 4) -> int:
+    """计算图片的差值哈希（dHash，hash_size*hash_size 位），相似图片的哈希汉明距离很小
+
+    卦象图只在个别爻线的断口处不同，8x8的哈希中相邻卦象的距离只有1~2，默认使用16x16；
+    相邻格子的亮度差超过 tolerance 才记为1，否则扫描噪点会使空白区域的位随机翻转（σ=12的噪点下约60位）
+    """
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    resized = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA).astype(int)
+    bits = (resized[:, 1:] - resized[:, :-1] > tolerance).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+class PerceptualHashIndex:
+    """感知哈希索引：汉明距离不超过阈值的图片视为同一图形，共享描述结果"""
+
+    def __init__(self, max_distance: int = 10, index_path=None, namespace: str = '', hash_size: int = 16,
+                 tolerance: int = 4):
+        self.logger = logging.getLogger(__name__)
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.tolerance = tolerance
+        self.index_path = Path(index_path) if index_path else None
+        # 描述结果与模型相关，不同模型的持久化索引互不复用
+        self.namespace = namespace
+        self.entries = []
+        # 有新条目时才需要写回文件
+        self.dirty = False
+
+        self.lookups = 0
+        self.hits = 0
+
+        if self.index_path and self.index_path.exists():
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            self.logger.warning(f"感知哈希索引读取失败，将重新建立: {str(e)}")
+            return
+        if data.get('namespace') != self.namespace:
+            self.logger.info("感知哈希索引属于其他模型，忽略已有内容")
+            return
+        if data.get('hash_size', 8) != self.hash_size or data.get('tolerance', 0) != self.tolerance:
+            self.logger.info("感知哈希索引的哈希参数不同，忽略已有内容")
+            return
+        self.entries = [(int(h, 16), value) for h, value in data.get('entries', [])]
+        self.logger.info(f"已加载感知哈希索引: {len(self.entries)} 个图形")
+
+    def lookup(self, image_hash: int) -> Optional[str]:
+        """查找汉明距离最近且不超过阈值的条目"""
+        self.lookups += 1
+        best = None
+        best_distance = self.max_distance + 1
+        for entry_hash, value in self.entries:
+            distance = hamming_distance(image_hash, entry_hash)
+            if distance < best_distance:
+                best, best_distance = value, distance
+        if best is not None:
+            self.hits += 1
+        return best
+
+    def hash(self, image) -> int:
+        """按索引的哈希参数计算图片的dHash"""
+        return dhash(image, self.hash_size, self.tolerance)
+
+    def add(self, image_hash: int, value: str) -> None:
+        self.entries.append((image_hash, value))
+        self.dirty = True
+
+    def save(self) -> None:
+        """持久化索引，供后续书籍复用；没有新条目时不写文件"""
+        if not self.index_path or not self.dirty:
+            return
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'namespace': self.namespace,
+                'hash_size': self.hash_size,
+                'tolerance': self.tolerance,
+                'entries': [[f"{h:0{self.hash_size ** 2 // 4}x}", value] for h, value in self.entries]
+            }, f, ensure_ascii=False)
+        tmp_path.replace(self.index_path)
+        self.dirty = False
@@ -0,0 +1,257 @@
+import queue
+import threading
+import time
+import logging
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+# 队列中的结束标记
+_END = object()
+
+class _Failure:
+    """某个阶段处理失败，异常随数据流传到输出端后重新抛出"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+class PipelineStage:
+    """流水线中的一个阶段：由若干工作线程执行同一个处理函数
+
+    batch_size大于1时，工作线程一次取出多项数据，函数接收并返回列表，适用于BLIP这类批量推理的阶段：
+    取到第一项后继续等待，直到各项权重（batch_weight，默认每项为1，例如每页的图片数）之和达到batch_size、
+    等待超过batch_timeout秒或上游结束；batch_timeout为None时一直等到凑满
+    """
+
+    def __init__(self, name: str, function: Callable, workers: int = 1, batch_size: int = 1,
+                 batch_timeout: Optional[float] = 0.0, batch_weight: Optional[Callable] = None):
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_timeout = batch_timeout
+        self.batch_weight = batch_weight
+
+        self.items = 0
+        self.batches = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self._finished_workers = 0
+        self._lock = threading.Lock()
+
+    def _record(self, busy: float = 0.0, starved: float = 0.0, blocked: float = 0.0,
+                items: int = 0, batches: int = 0) -> None:
+        with self._lock:
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+            self.items += items
+            self.batches += batches
+
+    def metrics(self, elapsed: float) -> Dict:
+        """busy为处理耗时，starved为等待上游的耗时，blocked为下游队列已满时的等待耗时（背压）"""
+        capacity = elapsed * self.workers
+        return {
+            'workers': self.workers,
+            'items': self.items,
+            'batches': self.batches,
+            'busy_s': round(self.busy, 3),
+            'starved_s': round(self.starved, 3),
+            'blocked_s': round(self.blocked, 3),
+            'utilization': round(self.busy / capacity, 3) if capacity else 0.0
+        }
+
+class PipelineExecutor:
+    """多阶段流水线：相邻阶段之间用有界队列连接，各阶段并发处理不同页面
+
+    队列已满时上游阶段阻塞等待，内存中同时存在的页面数受队列长度限制；
+    输出按输入顺序产出
+    """
+
+    def __init__(self, stages: List[PipelineStage], queue_size: int = 4, source_name: str = 'source',
+                 source_workers: int = 1):
+        self.logger = logging.getLogger(__name__)
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        # 数据源（迭代器）本身也作为一个阶段统计耗时
+        self.source = PipelineStage(source_name, None, source_workers)
+        self._stop = threading.Event()
+        self._started = None
+        self._finished = None
+
+    def run(self, items: Iterable) -> Iterator:
+        """启动流水线并按输入顺序产出最后一个阶段的结果"""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        self._stop.clear()
+        self._started = time.perf_counter()
+
+        threads = [threading.Thread(
+            target=self._feed, args=(items, queues[0]), name='pipeline-source', daemon=True
+        )]
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, args=(stage, queues[index], queues[index + 1]),
+                    name=f"pipeline-{stage.name}-{worker}", daemon=True
+                ))
+        for thread in threads:
+            thread.start()
+
+        try:
+            yield from self._reorder(queues[-1])
+        finally:
+            self._finished = time.perf_counter()
+            # 提前结束（出错或调用方停止迭代）时通知各线程退出
+            self._stop.set()
+            for q in queues:
+                self._drain(q)
+
+    def _put(self, q: queue.Queue, item) -> float:
+        """放入队列，下游已满时等待；返回等待耗时"""
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        return time.perf_counter() - start
+
+    def _get(self, q: queue.Queue):
+        """从队列取出一项，上游暂无数据时等待；返回 (数据, 等待耗时)"""
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1), time.perf_counter() - start
+            except queue.Empty:
+                continue
+        return _END, time.perf_counter() - start
+
+    @staticmethod
+    def _drain(q: queue.Queue) -> None:
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                return
+
+    def _feed(self, items: Iterable, output: queue.Queue) -> None:
+        source = self.source
+        iterator = iter(items)
+        sequence = 0
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            except BaseException as e:
+                source._record(busy=time.perf_counter() - start)
+                self._put(output, (sequence, _Failure(e)))
+                break
+            busy = time.perf_counter() - start
+            blocked = self._put(output, (sequence, item))
+            source._record(busy=busy, blocked=blocked, items=1, batches=1)
+            sequence += 1
+        self._put(output, _END)
+
+    @staticmethod
+    def _weight(stage: PipelineStage, item) -> int:
+        _, value = item
+        if stage.batch_weight is None:
+            return 1
+        return 0 if isinstance(value, _Failure) else stage.batch_weight(value)
+
+    def _take_batch(self, stage: PipelineStage, q: queue.Queue):
+        """取出一批数据：阻塞等待第一项，之后在超时前继续收集，直到权重之和达到batch_size"""
+        first, starved = self._get(q)
+        if first is _END:
+            return [], True, starved
+        batch = [first]
+        weight = self._weight(stage, first)
+        fill_start = time.perf_counter()
+        deadline = None if stage.batch_timeout is None else fill_start + stage.batch_timeout
+        while weight < stage.batch_size and not self._stop.is_set():
+            if deadline is not None and time.perf_counter() >= deadline:
+                # 超时后只取已就绪的项
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    break
+            else:
+                timeout = 0.1 if deadline is None else min(0.1, deadline - time.perf_counter())
+                try:
+                    item = q.get(timeout=max(timeout, 0.001))
+                except queue.Empty:
+                    continue
+            if item is _END:
+                # 结束标记放回队列，交给同阶段的其他线程；流水线停止后不再等待
+                self._put(q, item)
+                break
+            batch.append(item)
+            weight += self._weight(stage, item)
+        starved += time.perf_counter() - fill_start
+        return batch, False, starved
+
+    def _work(self, stage: PipelineStage, input_queue: queue.Queue, output_queue: queue.Queue) -> None:
+        while True:
+            batch, ended, starved = self._take_batch(stage, input_queue)
+            if ended:
+                stage._record(starved=starved)
+                break
+
+            # 上游失败的数据直接向下传递
+            failures = [(sequence, item) for sequence, item in batch if isinstance(item, _Failure)]
+            batch = [(sequence, item) for sequence, item in batch if not isinstance(item, _Failure)]
+
+            start = time.perf_counter()
+            try:
+                if stage.batch_size > 1:
+                    results = stage.function([item for _, item in batch]) if batch else []
+                else:
+                    results = [stage.function(item) for _, item in batch]
+                outputs = [(sequence, result) for (sequence, _), result in zip(batch, results)]
+            except BaseException as e:
+                self.logger.error(f"流水线阶段 {stage.name} 处理失败: {str(e)}")
+                outputs = [(sequence, _Failure(e)) for sequence, _ in batch]
+            busy = time.perf_counter() - start
+
+            blocked = 0.0
+            for output in sorted(failures + outputs, key=lambda pair: pair[0]):
+                blocked += self._put(output_queue, output)
+            stage._record(busy=busy, starved=starved, blocked=blocked,
+                          items=len(batch), batches=1 if batch else 0)
+
+        # 同阶段最后一个退出的线程向下游传递结束标记；出错停止后队列可能已满，不能无限等待
+        self._put(input_queue, _END)
+        with stage._lock:
+            stage._finished_workers += 1
+            last = stage._finished_workers == stage.workers
+        if last:
+            self._put(output_queue, _END)
+
+    def _reorder(self, q: queue.Queue) -> Iterator:
+        pending = {}
+        next_sequence = 0
+        while True:
+            item, _ = self._get(q)
+            if item is _END:
+                break
+            sequence, value = item
+            pending[sequence] = value
+            while next_sequence in pending:
+                value = pending.pop(next_sequence)
+                if isinstance(value, _Failure):
+                    raise value.error
+                yield value
+                next_sequence += 1
+
+    def metrics(self) -> Dict:
+        """各阶段的处理量、耗时和利用率"""
+        end = self._finished or time.perf_counter()
+        elapsed = end - self._started if self._started else 0.0
+        stages = [self.source] + self.stages
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'queue_size': self.queue_size,
+            'stages': {stage.name: stage.metrics(elapsed) for stage in stages}
+        }
@@ -1,5 +1,7 @@
 import json
 import logging
+import re
+from bisect import bisect_right
 from pathlib import Path
 from typing import List, Dict
 from volcenginesdkarkruntime import Ark
@@ -8,6 +10,12 @@ import os
 import yaml  # 确保导入 yaml 模块
 from tenacity import retry, stop_after_attempt, wait_fixed  # 导入重试机制
 
+# 前后10个字符内有换行符的句末标点，即原实现中 text[end-10:end+10] 含换行的断句点
+_BOUNDARY_PATTERN = re.compile(
+    r'[\u3002\uff01\uff1f.!?](?:(?=[^\n]{0,8}\n)|'
+    + '|'.join(f'(?<=\n.{{{k}}}[\u3002\uff01\uff1f.!?])' for k in range(10)) + ')'
+)
+
 class QAGenerator:
     def __init__(self, config):
         self.config = config['qa_generation']
@@ -24,9 +32,19 @@ class QAGenerator:
         # 调整为更大的段落大小
         self.max_segment_length = self.config.get('max_segment_length', 8000)
         self.overlap_length = self.config.get('overlap_length', 1000)
+        if self.overlap_length >= self.max_segment_length:
+            # 重叠不小于段落长度时无法向前推进
+            self.logger.warning(f"overlap_length ({self.overlap_length}) 不小于 max_segment_length，已调整为其一半")
+            self.overlap_length = self.max_segment_length // 2
+    
+    @staticmethod
+    def _sentence_boundaries(text: str) -> List[int]:
+        """返回前后10个字符内有换行符的句末标点位置（升序）"""
+        return [match.start() for match in _BOUNDARY_PATTERN.finditer(text)]
     
     def _split_text(self, text: str) -> List[str]:
-        """将长文本分割成有重叠的段落"""
+        """将长文本分割成有重叠的段落，优先在靠近换行的句末标点处切割"""
+        boundaries = self._sentence_boundaries(text)
         segments = []
         start = 0
         
@@ -36,14 +54,11 @@ class QAGenerator:
                 segments.append(text[start:])
                 break
             
-            # 在最大长度位置寻找段落结束点
+            # 取 (start + overlap, start + max] 内最靠后的断句点，保证下一段的起点向前推进
             end = start + self.max_segment_length
-            # 优先在段落结束处切割
-            while end > start and not (text[end] in '。！？.!?' and '\n' in text[end-10:end+10]):
-                end -= 1
-            
-            if end == start:  # 如果找不到合适的断句点
-                end = start + self.max_segment_length
+            index = bisect_right(boundaries, end) - 1
+            if index >= 0 and boundaries[index] > start + self.overlap_length:
+                end = boundaries[index]
             
             segments.append(text[start:end+1])
             start = end - self.overlap_length
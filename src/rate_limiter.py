@@ -0,0 +1,33 @@
+import asyncio
+import time
+
+class TokenBucket:
+    """令牌桶限速：按固定速率补充令牌，令牌不足时等待，等待的请求按先后顺序放行"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        # 超过桶容量的请求只需等到桶满，避免永远无法放行
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """按实际用量修正已扣除的令牌，amount为负数时返还多扣的部分"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
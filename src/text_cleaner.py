@@ -1,31 +1,107 @@
 import re
+import codecs
 import unicodedata
+from functools import lru_cache
 import logging
+import threading
 import argparse
 import os
+import math
+from collections import Counter
 from typing import List, Dict
 import yaml
 import chardet
 
+class _CleaningTable(dict):
+    """str.translate 使用的字符转换表，首次遇到某个字符时计算并缓存其转换结果
+
+    空白字符统一为空格，换行类字符统一为换行，控制、私用和未分配字符（类别C）删除
+    """
+
+    def __missing__(self, code_point):
+        ch = chr(code_point)
+        if ch.isspace():
+            # 与 str.splitlines 一致的行分隔符保留为换行
+            value = '\n' if len(f"a{ch}b".splitlines()) == 2 else ' '
+        elif unicodedata.category(ch)[0] == 'C':
+            value = None
+        else:
+            value = code_point
+        self[code_point] = value
+        return value
+
+_TRANSLATION = _CleaningTable()
+
+def _char_class(chars) -> str:
+    """将字符列表压缩为正则字符类中的区间"""
+    ranges = []
+    for ch in chars:
+        if ranges and ord(ch) == ord(ranges[-1][1]) + 1:
+            ranges[-1][1] = ch
+        else:
+            ranges.append([ch, ch])
+    return ''.join(
+        re.escape(first) if first == last else f"{re.escape(first)}-{re.escape(last)}"
+        for first, last in ranges
+    )
+
+@lru_cache(maxsize=None)
+def _line_pattern():
+    """按字符类别构建单遍清理用的组合正则，每个进程只构建一次
+
+    基本多文种平面的字符直接写入字符类；其他平面的字符较少见，匹配后再用转换表判断
+    """
+    horizontal, vertical, removed = [], [], []
+    for code_point in range(0x10000):
+        value = _TRANSLATION[code_point]
+        if value == ' ':
+            horizontal.append(chr(code_point))
+        elif value == '\n':
+            vertical.append(chr(code_point))
+        elif value is None:
+            removed.append(chr(code_point))
+    space = f"[{_char_class(horizontal)}]"
+    other_space = f"[{_char_class(ch for ch in horizontal if ch != ' ')}]"
+    newline = f"[{_char_class(vertical)}]"
+    removed_class = _char_class(removed)
+    # 空白与待删除字符都不影响空行、页码行的判断
+    gap = f"[{_char_class(sorted(horizontal + removed))}]"
+    return re.compile(
+        # 一个换行及其前后的空白，连同其后的空行和纯数字行（页码）合并为一个换行
+        rf'(?P<newline>{gap}*{newline}(?:{gap}*(?:\d+{gap}*)?{newline})*{gap}*)'
+        # 连续空白或单个非空格的空白字符统一为一个空格
+        rf'|(?P<spaces>{space}(?:[{removed_class}]*{space})+|{other_space})'
+        # 控制、私用和未分配字符删除
+        rf'|(?P<removed>[{removed_class}\U00010000-\U0010ffff]+)'
+    )
+
+def _replace(match) -> str:
+    if match.lastgroup == 'newline':
+        return '\n'
+    if match.lastgroup == 'spaces':
+        return ' '
+    return match.group().translate(_TRANSLATION)
+
+def normalize_line(line: str) -> str:
+    """页眉页脚比较用的归一化：去掉空白，数字统一为#（页码不同的同一页眉视为相同）"""
+    return re.sub(r'\d+', '#', ''.join(line.split())).lower()
+
 class TextCleaner:
     def __init__(self, config):
         self.logger = logging.getLogger(__name__)
         self.config = config['text_correction']
+        self._pattern = _line_pattern()
         
-    def clean_text(self, text: str) -> str:
-        """清理文本内容"""
-        # 统一空白字符
-        text = re.sub(r'\s+', ' ', text)
-        
-        # 移除特殊控制字符
-        text = ''.join(ch for ch in text if unicodedata.category(ch)[0] != 'C')
-        
-        # 移除多余的空行
-        text = re.sub(r'\n\s*\n', '\n', text)
-        
-        # 移除页眉页脚常见的数字标记
-        text = re.sub(r'^\d+\s*$', '', text, flags=re.MULTILINE)
+        # 跨页重复行（页眉、页脚、出版信息）的识别参数
+        self.boilerplate = config.get('text_cleaning', {}).get('boilerplate', {})
+        # 已识别的重复行，后续页面直接删除
+        self.boilerplate_lines = set()
+        self.boilerplate_stats = {'pages': 0, 'chars_before': 0, 'lines_removed': 0, 'chars_removed': 0}
         
+    def clean_text(self, text: str) -> str:
+        """清理文本内容：统一空白字符、移除控制字符、空行和页码行，保留换行结构"""
+        # 首尾补换行，使首行和末行的页码也能被同一个正则匹配
+        text = self._pattern.sub(_replace, f"\n{text}\n")
         return text.strip()
     
     def process_page_data(self, page_data: Dict) -> Dict:
@@ -37,12 +113,198 @@ class TextCleaner:
             self.logger.error(f"处理页面 {page_data.get('page_number')} 时发生错误: {str(e)}")
             return page_data
     
+    def _edge_lines(self, lines: List[str]) -> List[int]:
+        """每页开头和结尾的若干非空行的下标
+        
+        非空行不超过首尾行数之和的短页（如只有一段引文的页面）所有行都在首尾，不参与统计和删除
+        """
+        edge_count = self.boilerplate.get('edge_lines', 2)
+        non_empty = [index for index, line in enumerate(lines) if line.strip()]
+        if len(non_empty) <= 2 * edge_count:
+            return []
+        return sorted(set(non_empty[:edge_count] + non_empty[-edge_count:]))
+    
+    def _ngrams(self, normalized: str) -> set:
+        size = self.boilerplate.get('ngram_size', 4)
+        return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+    
+    def find_boilerplate(self, document: List[Dict]) -> List[set]:
+        """统计各页首尾行在多少页中出现，返回每页中应删除的行下标
+        
+        归一化后完全相同的行按出现页数判断；OCR结果略有差异的页眉按字符n元组判断：
+        行内大部分n元组都在多页首尾出现时同样视为重复行
+        """
+        page_lines = [page['text'].split('\n') for page in document]
+        page_edges = [self._edge_lines(lines) for lines in page_lines]
+        
+        line_pages = Counter()
+        ngram_pages = Counter()
+        for lines, edges in zip(page_lines, page_edges):
+            normalized = {normalize_line(lines[index]) for index in edges}
+            line_pages.update(normalized)
+            ngram_pages.update(set().union(*(self._ngrams(line) for line in normalized)))
+        
+        enough_pages = len(document) >= self.boilerplate.get('min_pages', 3)
+        threshold = max(2, math.ceil(self.boilerplate.get('min_page_ratio', 0.3) * len(document)))
+        coverage = self.boilerplate.get('ngram_coverage', 0.8)
+        
+        removals = []
+        for lines, edges in zip(page_lines, page_edges):
+            remove = set()
+            for index in edges:
+                normalized = normalize_line(lines[index])
+                if normalized in self.boilerplate_lines:
+                    remove.add(index)
+                    continue
+                if not enough_pages:
+                    continue
+                if line_pages[normalized] >= threshold:
+                    # 完全相同的重复行记录下来，用于后续页面
+                    self.boilerplate_lines.add(normalized)
+                    remove.add(index)
+                    continue
+                ngrams = self._ngrams(normalized)
+                frequent = sum(1 for ngram in ngrams if ngram_pages[ngram] >= threshold)
+                if ngrams and frequent >= coverage * len(ngrams):
+                    remove.add(index)
+            removals.append(remove)
+        return removals
+    
+    def remove_boilerplate(self, document: List[Dict]) -> List[Dict]:
+        """删除跨页重复出现的页眉、页脚等行，并累计删除的字符数"""
+        if not self.boilerplate.get('enable', True) or not document:
+            return document
+        
+        removals = self.find_boilerplate(document)
+        stats = self.boilerplate_stats
+        for page, remove in zip(document, removals):
+            stats['pages'] += 1
+            stats['chars_before'] += len(page['text'])
+            if not remove:
+                continue
+            lines = page['text'].split('\n')
+            stats['lines_removed'] += len(remove)
+            stats['chars_removed'] += sum(len(lines[index]) for index in remove)
+            page['text'] = '\n'.join(line for index, line in enumerate(lines) if index not in remove).strip()
+        return document
+    
     def process_document(self, document: List[Dict]) -> List[Dict]:
-        """处理整个文档的数据"""
-        return [self.process_page_data(page) for page in document]
+        """处理整个文档的数据：逐页清理后删除跨页重复的页眉页脚"""
+        document = [self.process_page_data(page) for page in document]
+        document = self.remove_boilerplate(document)
+        if self.boilerplate_stats['chars_removed']:
+            self.logger.info(
+                f"删除页眉页脚等重复行 {self.boilerplate_stats['lines_removed']} 行，"
+                f"共 {self.boilerplate_stats['chars_removed']} 个字符"
+            )
+        return document
+
+# 编码检测失败时依次尝试的编码；UTF-8校验最严格，放在最前
+FALLBACK_ENCODINGS = ['utf-8', 'gb18030', 'gbk', 'gb2312', 'utf-16', 'big5']
+
+def _decodes(sample: bytes, encoding: str) -> bool:
+    """样本能否按指定编码解码，末尾被截断的多字节字符不算错误"""
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+        return True
+    except (UnicodeDecodeError, LookupError):
+        return False
+
+def detect_encoding(input_path: str, sample_size: int = 1 << 16) -> str:
+    """只读取文件开头和中间的样本检测编码，避免对整个大文件运行chardet"""
+    file_size = os.path.getsize(input_path)
+    with open(input_path, 'rb') as file:
+        head = file.read(sample_size)
+        middle = b''
+        if file_size > 2 * sample_size:
+            file.seek(file_size // 2)
+            middle = file.read(sample_size)
+    
+    encoding = chardet.detect(head + middle)['encoding']
+    if encoding:
+        encoding = encoding.lower()
+        # 样本中可能恰好没有出现GBK扩展字符，统一按其超集GB18030解码
+        if encoding in ('gb2312', 'gbk', 'ascii'):
+            encoding = 'utf-8' if encoding == 'ascii' and _decodes(head, 'utf-8') else 'gb18030'
+        if _decodes(head, encoding):
+            return encoding
+    
+    for candidate in FALLBACK_ENCODINGS:
+        if _decodes(head, candidate):
+            return candidate
+    raise UnicodeDecodeError('unknown', head[:1], 0, 1, f"无法识别文件编码: {input_path}")
 
-def main(input_path='G:\see\梅花易数白话解 (（宋）邵雍著；刘光本，荣益译) (Z-Library).txt', output_dir='G:/see/output/'):
-    with open('config/config.yaml', 'r', encoding='utf-8') as file:
+# 无法解码的字节替换为U+FFFD并计数，每次解码前清零；解码是同步调用，线程内不会交错
+_replacements = threading.local()
+
+def _count_replacement(error: UnicodeDecodeError):
+    _replacements.count += error.end - error.start
+    if _replacements.first is None:
+        _replacements.first = error.start
+    return '\ufffd', error.end
+
+codecs.register_error('count_replace', _count_replacement)
+
+def iter_decoded_chunks(input_path: str, encoding: str, chunk_size: int = 1 << 20, stats: Dict = None):
+    """按块增量解码文件，每次产出以完整行结尾的文本
+
+    行尾为 \n 或 \r（旧式Mac换行）；超过 chunk_size 个字符仍没有换行时直接产出，避免整个文件积压在内存中。
+    无法解码的字节替换为U+FFFD，替换的字节数记入 stats['replaced_bytes'] 并写入日志
+    """
+    logger = logging.getLogger(__name__)
+    stats = stats if stats is not None else {}
+    stats.setdefault('replaced_bytes', 0)
+    decoder = codecs.getincrementaldecoder(encoding)(errors='count_replace')
+    remainder = ''
+    offset = 0
+    with open(input_path, 'rb') as file:
+        while True:
+            raw = file.read(chunk_size)
+            _replacements.count = 0
+            _replacements.first = None
+            text = remainder + decoder.decode(raw, final=not raw)
+            if _replacements.count:
+                if not stats['replaced_bytes']:
+                    logger.warning(
+                        f"{input_path} 第 {offset + _replacements.first} 字节附近无法按 {encoding} 解码，已替换为U+FFFD"
+                    )
+                stats['replaced_bytes'] += _replacements.count
+            offset += len(raw)
+            if not raw:
+                if text:
+                    yield text
+                if stats['replaced_bytes']:
+                    logger.warning(f"{input_path} 共有 {stats['replaced_bytes']} 个字节无法按 {encoding} 解码")
+                return
+            # 不完整的最后一行留到下一块
+            cut = max(text.rfind('\n'), text.rfind('\r')) + 1
+            if not cut and len(text) > chunk_size:
+                cut = len(text)
+            remainder = text[cut:]
+            if cut:
+                yield text[:cut]
+
+def clean_file(cleaner: 'TextCleaner', input_path: str, output_path: str, encoding: str,
+               chunk_size: int = 1 << 20, stats: Dict = None) -> int:
+    """流式清理文本文件并以UTF-8写出，内存占用与文件大小无关；返回写出的字符数"""
+    written = 0
+    line_ended = True
+    with open(output_path, 'w', encoding='utf-8') as outfile:
+        for chunk in iter_decoded_chunks(input_path, encoding, chunk_size, stats):
+            # 清理规则都在行内生效，按块清理与整篇清理结果一致；超长行被截断的块直接续接
+            cleaned = cleaner.clean_text(chunk)
+            if cleaned:
+                if written and line_ended:
+                    outfile.write('\n')
+                    written += 1
+                outfile.write(cleaned)
+                written += len(cleaned)
+            line_ended = chunk.endswith(('\n', '\r'))
+    return written
+
+def main(input_path='G:\see\梅花易数白话解 (（宋）邵雍著；刘光本，荣益译) (Z-Library).txt', output_dir='G:/see/output/',
+         config_path='config/config.yaml', chunk_size=1 << 20, sample_size=1 << 16):
+    with open(config_path, 'r', encoding='utf-8') as file:
         config = yaml.safe_load(file)
     
     cleaner = TextCleaner(config)
@@ -52,40 +314,19 @@ def main(input_path='G:\see\梅花易数白话解 (（宋）邵雍著；刘光
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
         
-        # 首先检测文件编码
-        with open(input_path, 'rb') as file:
-            raw_data = file.read()
-            detected = chardet.detect(raw_data)
-            encoding = detected['encoding']
-            print(f"Detected encoding: {encoding}")
-        
-        # 按检测到的编码读取文件
-        try:
-            with open(input_path, 'r', encoding=encoding) as infile:
-                text = infile.read()
-                print(f"Successfully read file with {encoding} encoding")
-        except UnicodeDecodeError:
-            # 如果检测失败，尝试其他常见编码
-            encodings = ['gb18030', 'gbk', 'gb2312', 'utf-8', 'utf-16', 'big5']
-            for enc in encodings:
-                try:
-                    with open(input_path, 'r', encoding=enc) as infile:
-                        text = infile.read()
-                        encoding = enc
-                        print(f"Successfully read file with {enc} encoding")
-                        break
-                except UnicodeDecodeError:
-                    continue
-        
-        cleaned_text = cleaner.clean_text(text)
+        # 根据文件样本检测编码
+        encoding = detect_encoding(input_path, sample_size)
+        print(f"Detected encoding: {encoding}")
         
         output_filename = os.path.basename(input_path)
         output_path = os.path.join(output_dir, output_filename)
         
-        # 使用 UTF-8 编码写入
-        with open(output_path, 'w', encoding='utf-8') as outfile:
-            outfile.write(cleaned_text)
+        # 逐块解码、清理并以 UTF-8 编码写入
+        stats = {}
+        clean_file(cleaner, input_path, output_path, encoding, chunk_size, stats)
         print(f"File saved with UTF-8 encoding")
+        if stats['replaced_bytes']:
+            print(f"Replaced {stats['replaced_bytes']} undecodable bytes with U+FFFD")
     else:
         # 适配原来的运行方式
         document = [
@@ -95,4 +336,11 @@ def main(input_path='G:\see\梅花易数白话解 (（宋）邵雍著；刘光
         # ...existing code...
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='文本清理工具')
+    parser.add_argument('input_path', nargs='?', default=main.__defaults__[0], help='输入文本文件')
+    parser.add_argument('output_dir', nargs='?', default=main.__defaults__[1], help='输出目录')
+    parser.add_argument('--config', default='config/config.yaml', help='配置文件路径')
+    parser.add_argument('--chunk-size', type=int, default=1 << 20, help='每次读取解码的字节数')
+    parser.add_argument('--sample-size', type=int, default=1 << 16, help='编码检测读取的样本字节数')
+    args = parser.parse_args()
+    main(args.input_path, args.output_dir, args.config, args.chunk_size, args.sample_size)
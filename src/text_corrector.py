@@ -1,89 +1,415 @@
-import time
+import asyncio
+import math
+import re
+import threading
 import logging
-from typing import List, Dict
-from volcenginesdkarkruntime import Ark
+from typing import List, Dict, Tuple
+from pathlib import Path
+from rate_limiter import TokenBucket
+from correction_cache import CorrectionCache
+from ocr_confidence import low_confidence_mask, suspicious_windows
+from edit_script import EditScriptError, parse_edits, apply_edits, parse_window_fixes
+
+# 修改提示词时递增版本号，使旧的缓存结果失效
+PROMPT_VERSION = 1
+SYSTEM_PROMPT = "你是一个专业的文本校对专家，负责修正OCR文本中的错误。请直接返回修正后的文本，不需要任何额外说明。"
+USER_PROMPT = "请帮我校对和修正以下OCR识别的文本，确保文字通顺、无错别字：\n\n{text}"
+# 修改列表模式：模型只返回需要修改的片段，输出令牌数与错误数量成正比
+EDIT_SYSTEM_PROMPT = (
+    "你是一个专业的文本校对专家，负责修正OCR文本中的错误。只输出需要修改的地方，格式为JSON数组，"
+    "每项为 {\"old\": 原文中的错误片段, \"new\": 修正后的片段, \"before\": 错误片段之前紧邻的几个字}。"
+    "按原文顺序列出，old 必须与原文完全一致，没有错误时输出 []，不要输出任何其他内容。"
+)
+EDIT_USER_PROMPT = "请找出以下OCR识别文本中的错别字和识别错误：\n\n{text}"
+# 可疑片段模式：一页的多个可疑片段编号后一次发送，模型只返回【】内文字的修正
+WINDOW_SYSTEM_PROMPT = (
+    "你是一个专业的文本校对专家，负责修正OCR文本中的错误。每行是一个编号的片段，【】中的文字可能识别有误，"
+    "其余文字是上下文。输出JSON对象，键为片段编号，值为【】中文字修正后的内容（不含【】和上下文），"
+    "没有错误的片段不要列出，全部正确时输出 {}，不要输出任何其他内容。"
+)
+WINDOW_USER_PROMPT = "请修正以下各片段【】中的OCR识别错误：\n\n{text}"
+PROMPTS = {
+    'full': (SYSTEM_PROMPT, USER_PROMPT),
+    'edits': (EDIT_SYSTEM_PROMPT, EDIT_USER_PROMPT),
+    'windows': (WINDOW_SYSTEM_PROMPT, WINDOW_USER_PROMPT),
+}
+SAMPLING = {'temperature': 0.3, 'top_p': 0.8}
+
+_TOKEN_PATTERN = re.compile(r'(?P<word>[A-Za-z]+)|(?P<number>\d+)|(?P<space>\s+)|(?P<char>.)', re.S)
+# 句末标点（可带后引号或括号）之后切分
+_SENTENCE_END = re.compile(r'[\u3002\uff01\uff1f\uff1b!?;\u2026]+[\u201d\u2019\u300d\u300f\uff09)"\']*')
+
+class OutputTruncated(Exception):
+    """模型输出达到 max_tokens 被截断"""
+
+def estimate_tokens(text: str) -> int:
+    """近似BPE分词估算令牌数：汉字和标点各算一个令牌，英文单词约四个字母、数字约三位一个令牌
+
+    每个字符最多计一个令牌，按字符数切分的片段不会超过相同的令牌数
+    """
+    tokens = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if kind == 'word':
+            tokens += math.ceil(len(match.group()) / 4)
+        elif kind == 'number':
+            tokens += math.ceil(len(match.group()) / 3)
+        elif kind == 'space':
+            tokens += match.group().count('\n')
+        else:
+            tokens += 1
+    return tokens
+
+def split_sentences(paragraph: str, max_tokens: int) -> List[str]:
+    """在句末标点处切分超长段落，单句仍超出令牌上限时按字符数硬切分"""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(paragraph):
+        sentences.append(paragraph[start:match.end()])
+        start = match.end()
+    if start < len(paragraph):
+        sentences.append(paragraph[start:])
+    
+    pieces = []
+    for sentence in sentences:
+        if estimate_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+        else:
+            pieces.extend(sentence[i:i + max_tokens] for i in range(0, len(sentence), max_tokens))
+    return pieces
 
 class TextCorrector:
     def __init__(self, config):
         self.config = config['text_correction']
         self.logger = logging.getLogger(__name__)
         
-        # 初始化 Ark 客户端
-        self.client = Ark(
-            ak=self.config['api_key'],
-            sk=self.config['api_secret'],
-            region='cn-north-1'  # 确保指定正确的区域
-        )
+        # Ark 客户端在第一次调用API时才创建
+        self._client = None
         self.model_id = self.config['model_name']
         
         self.max_retries = self.config.get('max_retries', 3)
-        self.batch_size = self.config.get('batch_size', 1000)
+        self.retry_delay = self.config.get('retry_delay', 1)
+        
+        # 校正结果与输入长度相当，片段令牌数按输出上限留出余量，避免输出被截断
+        self.max_output_tokens = self.config.get('max_output_tokens', 2048)
+        self.segment_tokens = self.config.get('max_segment_tokens') or max(
+            1, int(self.max_output_tokens / self.config.get('output_headroom', 1.25))
+        )
+        self.sampling = dict(SAMPLING, max_tokens=self.max_output_tokens)
+        # full: 模型返回校正后的全文；edits: 模型返回修改列表，在本地应用，无法应用时改为全文校正
+        self.mode = self.config.get('mode', 'full')
+        if self.mode not in PROMPTS:
+            raise ValueError(f"不支持的校正模式: {self.mode}")
+        
+        # 所有调用方共享一个后台事件循环，并发数和速率限制对整本书生效
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self._semaphore = None
+        self._request_bucket = None
+        self._token_bucket = None
+        
+        # 相同段落的校正结果跨运行复用
+        self.cache = self._open_cache(config)
+        
+        # 只把低置信度的OCR片段送去校正
+        self.confidence = self.config.get('confidence', {})
+        
+        self.stats = {
+            'requests': 0, 'retries': 0, 'failures': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+            'truncated': 0, 'edits': 0, 'edit_fallbacks': 0, 'pages': 0, 'pages_skipped': 0, 'chars_total': 0, 'chars_sent': 0
+        }
     
-    def _call_api(self, text: str) -> str:
-        """调用豆包API进行文本校正"""
-        try:
-            # 创建对话请求
-            response = self.client.chat.completions.create(
-                model=self.model_id,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "你是一个专业的文本校对专家，负责修正OCR文本中的错误。请直接返回修正后的文本，不需要任何额外说明。"
-                    },
-                    {
-                        "role": "user",
-                        "content": f"请帮我校对和修正以下OCR识别的文本，确保文字通顺、无错别字：\n\n{text}"
-                    }
-                ],
-                temperature=0.3,
-                top_p=0.8,
-                max_tokens=2048
+    def _open_cache(self, config):
+        """按配置打开校正结果缓存，未启用时返回None"""
+        cache_config = self.config.get('cache', {})
+        if not cache_config.get('enable', True):
+            return None
+        output_dir = config.get('output', {}).get('output_dir', 'output')
+        cache_path = cache_config.get('path') or Path(output_dir) / 'correction_cache.sqlite'
+        return CorrectionCache(cache_path, cache_config.get('max_size_mb', 256))
+    
+    @property
+    def client(self):
+        if self._client is None:
+            from volcenginesdkarkruntime import AsyncArk
+            options = {'max_retries': 0}  # 重试由 _call_api 统一处理
+            if self.config.get('base_url'):
+                options['base_url'] = self.config['base_url']
+            if self.config.get('ark_api_key'):
+                options['api_key'] = self.config['ark_api_key']
+            else:
+                options.update(
+                    ak=self.config['api_key'],
+                    sk=self.config['api_secret'],
+                    region='cn-north-1'  # 确保指定正确的区域
+                )
+            # 初始化 Ark 客户端
+            self._client = AsyncArk(**options)
+        return self._client
+    
+    def _run(self, coroutine):
+        """在后台事件循环中执行协程并等待结果，多个线程同时调用时共享并发和限速"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='text-corrector', daemon=True).start()
+                # 限速器在事件循环中创建
+                asyncio.run_coroutine_threadsafe(self._init_limits(), self._loop).result()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+    
+    async def _init_limits(self):
+        self._semaphore = asyncio.Semaphore(max(1, self.config.get('concurrency', 8)))
+        requests_per_second = self.config.get('requests_per_second', 5)
+        if requests_per_second:
+            self._request_bucket = TokenBucket(requests_per_second)
+        tokens_per_minute = self.config.get('tokens_per_minute', 0)
+        if tokens_per_minute:
+            self._token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+    
+    def close(self):
+        """关闭客户端连接并停止后台事件循环"""
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        if self._loop is None:
+            return
+        if self._client is not None:
+            self._run(self._client.close())
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+    
+    async def _call_api(self, text: str, mode: str = 'full') -> str:
+        """调用豆包API进行文本校正，受并发数和速率限制，失败时按指数退避重试
+        
+        调用前先查询缓存，成功的结果连同令牌用量写入缓存；输出被截断时抛出 OutputTruncated，
+        修改列表无法应用时抛出 EditScriptError
+        """
+        cache_key = None
+        if self.cache is not None:
+            params = dict(self.sampling, mode=mode) if mode != 'full' else self.sampling
+            cache_key = self.cache.make_key(
+                text, model=self.model_id, prompt_version=PROMPT_VERSION, **params
             )
-            
-            return response.choices[0].message.content.strip()
-            
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        system_prompt, user_prompt = PROMPTS[mode]
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt.format(text=text)}
+        ]
+        # 预扣输入和预计输出的令牌，收到响应后按实际用量修正
+        estimated = estimate_tokens(system_prompt + messages[1]['content']) + estimate_tokens(text)
+        # 送入大模型的字符包括提示词
+        self.stats['chars_sent'] += len(system_prompt) + len(messages[1]['content'])
+        
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                if self._request_bucket:
+                    await self._request_bucket.acquire()
+                if self._token_bucket:
+                    await self._token_bucket.acquire(estimated)
+                try:
+                    # 创建对话请求
+                    response = await self.client.chat.completions.create(
+                        model=self.model_id,
+                        messages=messages,
+                        **self.sampling
+                    )
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        self.logger.error(f"API调用失败: {str(e)}")
+                        raise
+                    self.stats['retries'] += 1
+                    self.logger.warning(f"API调用失败，第 {attempt + 1} 次重试: {str(e)}")
+                    await asyncio.sleep(self.retry_delay * 2 ** attempt)
+                    continue
+                
+                self.stats['requests'] += 1
+                usage = getattr(response, 'usage', None)
+                if usage is not None:
+                    self.stats['prompt_tokens'] += usage.prompt_tokens
+                    self.stats['completion_tokens'] += usage.completion_tokens
+                    if self._token_bucket:
+                        self._token_bucket.adjust(usage.total_tokens - estimated)
+                choice = response.choices[0]
+                if choice.finish_reason == 'length':
+                    # 截断的结果不能替换原文，也不写入缓存
+                    self.stats['truncated'] += 1
+                    raise OutputTruncated(f"输出超过 {self.max_output_tokens} 个令牌")
+                content = choice.message.content.strip()
+                if mode == 'edits':
+                    # 缓存应用修改后的文本，无法应用的修改列表不写入缓存
+                    edits = parse_edits(content)
+                    content = apply_edits(text, edits)
+                    self.stats['edits'] += len(edits)
+                elif mode == 'windows':
+                    # 编号与片段数不符的结果不写入缓存
+                    parse_window_fixes(content, text.count('\n') + 1)
+                if cache_key is not None:
+                    self.cache.put(
+                        cache_key, content,
+                        usage.prompt_tokens if usage is not None else 0,
+                        usage.completion_tokens if usage is not None else 0
+                    )
+                return content
+    
+    async def _correct_segment(self, segment: str) -> str:
+        if not segment.strip():
+            return segment
+        try:
+            if self.mode == 'edits':
+                try:
+                    return await self._call_api(segment, 'edits')
+                except EditScriptError as e:
+                    self.stats['edit_fallbacks'] += 1
+                    self.logger.warning(f"修改列表无法应用，改为全文校正: {str(e)}")
+            return await self._call_api(segment)
+        except OutputTruncated as e:
+            # 只把被截断的片段对半拆开重新校正
+            pieces = self._split_text(segment, max(1, estimate_tokens(segment) // 2))
+            if len(pieces) == 1:
+                self.logger.error(f"文本片段无法继续拆分: {str(e)}")
+                return segment
+            self.logger.warning(f"{str(e)}，拆分为 {len(pieces)} 段重试")
+            return await self._correct_segments(pieces)
         except Exception as e:
-            self.logger.error(f"API调用失败: {str(e)}")
-            raise
+            self.stats['failures'] += 1
+            self.logger.error(f"处理文本段落时出错: {str(e)}")
+            return segment  # 如果失败则保留原文
+    
+    async def correct_text_async(self, text: str) -> str:
+        """并发校正各段落，结果按原顺序拼接"""
+        if not text.strip():
+            return text
+        
+        # 分段处理长文本
+        return await self._correct_segments(self._split_text(text))
+    
+    async def _correct_segments(self, segments: List[Tuple[str, str]]) -> str:
+        """并发校正 _split_text 返回的片段，并用原来的分隔符拼接"""
+        corrected = await asyncio.gather(*(self._correct_segment(segment) for segment, _ in segments))
+        return ''.join(text + separator for text, (_, separator) in zip(corrected, segments))
     
     def correct_text(self, text: str) -> str:
         """处理文本并进行校正"""
         if not text.strip():
             return text
-            
-        # 分段处理长文本
-        segments = self._split_text(text)
-        corrected_segments = []
+        return self._run(self.correct_text_async(text))
+    
+    async def correct_page_async(self, page: Dict) -> str:
+        """校正单页文本：有单词置信度时只发送低置信度片段及其上下文，并在本地拼回原文"""
+        text = page['text']
+        if not text.strip():
+            return text
+        self.stats['pages'] += 1
+        self.stats['chars_total'] += len(text)
         
-        for segment in segments:
-            try:
-                corrected_text = self._call_api(segment)
-                corrected_segments.append(corrected_text)
-                # 添加延时避免API限制
-                time.sleep(0.5)
-            except Exception as e:
-                self.logger.error(f"处理文本段落时出错: {str(e)}")
-                corrected_segments.append(segment)  # 如果失败则保留原文
+        settings = self.confidence
+        if settings.get('enable', True):
+            # PDF自带文本层没有OCR错误
+            if page.get('text_source') == 'layer' and settings.get('skip_text_layer', True):
+                self.stats['pages_skipped'] += 1
+                return text
+            if page.get('ocr_lines') is not None:
+                mask = low_confidence_mask(text, page['ocr_lines'], settings.get('threshold', 80))
+                windows = suspicious_windows(text, mask, settings.get('context_chars', 20))
+                if not windows:
+                    self.stats['pages_skipped'] += 1
+                    return text
+                
+                # 每个窗口中从第一个到最后一个可疑字符的范围是待修正的文字，其余为上下文
+                spans = []
+                for start, end in windows:
+                    flagged = [index for index in range(start, end) if mask[index]]
+                    spans.append((start, flagged[0], flagged[-1] + 1, end))
+                groups = self._group_windows([(text[start:first], text[first:last], text[last:end]) for start, first, last, end in spans])
+                corrected = [fix for fixes in await asyncio.gather(*(self._correct_windows(group) for group in groups)) for fix in fixes]
+                # 从后往前只替换可疑文字，上下文保持原样，前面片段的位置不受影响
+                for (_, first, last, _), replacement in reversed(list(zip(spans, corrected))):
+                    text = text[:first] + replacement + text[last:]
+                return text
         
-        return "\n".join(corrected_segments)
+        # 没有置信度信息（如旧的检查点）时整页校正
+        return await self.correct_text_async(text)
     
-    def _split_text(self, text: str) -> List[str]:
-        """将长文本分割成适合API处理的片段"""
-        segments = []
-        current_segment = []
-        current_length = 0
-        
+    def _group_windows(self, windows: List[Tuple[str, str, str]]) -> List[List[Tuple[str, str, str]]]:
+        """按估算令牌数把一页的可疑片段合并成尽量少的请求"""
+        groups = []
+        tokens = 0
+        for window in windows:
+            window_tokens = estimate_tokens(''.join(window)) + 4
+            if not groups or tokens + window_tokens > self.segment_tokens:
+                groups.append([])
+                tokens = 0
+            groups[-1].append(window)
+            tokens += window_tokens
+        return groups
+    
+    async def _correct_windows(self, windows: List[Tuple[str, str, str]]) -> List[str]:
+        """一次请求校正多个编号的 (上文, 可疑文字, 下文) 片段，返回各片段可疑文字修正后的内容"""
+        text = '\n'.join(f"{number}. {before}【{span}】{after}" for number, (before, span, after) in enumerate(windows, 1))
+        try:
+            fixes = parse_window_fixes(await self._call_api(text, 'windows'), len(windows))
+        except OutputTruncated as e:
+            if len(windows) == 1:
+                self.logger.error(f"可疑片段无法继续拆分: {str(e)}")
+                return [span for _, span, _ in windows]
+            self.logger.warning(f"{str(e)}，拆分为 2 组重试")
+            half = len(windows) // 2
+            first, second = await asyncio.gather(self._correct_windows(windows[:half]), self._correct_windows(windows[half:]))
+            return first + second
+        except Exception as e:
+            self.stats['failures'] += 1
+            self.logger.error(f"处理可疑片段时出错: {str(e)}")
+            return [span for _, span, _ in windows]  # 如果失败则保留原文
+        self.stats['edits'] += sum(1 for number, (_, span, _) in enumerate(windows, 1) if fixes.get(number, span) != span)
+        return [fixes.get(number, span) for number, (_, span, _) in enumerate(windows, 1)]
+    
+    def correct_page(self, page: Dict) -> str:
+        """校正单页文本，返回校正后的文本"""
+        return self._run(self.correct_page_async(page))
+    
+    def correct_texts(self, texts: List[str]) -> List[str]:
+        """同时校正多段文本（如多页），结果顺序与输入一致"""
+        async def correct_all():
+            return await asyncio.gather(*(self.correct_text_async(text) for text in texts))
+        return self._run(correct_all())
+    
+    def _split_text(self, text: str, max_tokens: int = None) -> List[Tuple[str, str]]:
+        """按估算令牌数把长文本合并成尽量大的片段，超长段落在句末切分
+
+        返回 (片段, 与下一片段之间的分隔符) 列表，按顺序拼接即为原文
+        """
+        max_tokens = max_tokens or self.segment_tokens
+        pieces = []
         for paragraph in text.split('\n'):
-            if current_length + len(paragraph) > self.batch_size:
-                if current_segment:
-                    segments.append('\n'.join(current_segment))
-                current_segment = [paragraph]
-                current_length = len(paragraph)
-            else:
-                current_segment.append(paragraph)
-                current_length += len(paragraph)
+            tokens = estimate_tokens(paragraph)
+            if tokens <= max_tokens:
+                pieces.append((paragraph, tokens, '\n'))
+                continue
+            sentences = split_sentences(paragraph, max_tokens)
+            pieces.extend((sentence, estimate_tokens(sentence), '') for sentence in sentences[:-1])
+            pieces.append((sentences[-1], estimate_tokens(sentences[-1]), '\n'))
         
-        if current_segment:
-            segments.append('\n'.join(current_segment))
+        segments = []
+        current = None
+        current_tokens = 0
+        separator = ''
+        for piece, tokens, piece_separator in pieces:
+            # 换行符本身也算一个令牌
+            if current is not None and current_tokens + len(separator) + tokens > max_tokens:
+                segments.append((current, separator))
+                current = None
+            if current is None:
+                current, current_tokens = piece, tokens
+            else:
+                current += separator + piece
+                current_tokens += len(separator) + tokens
+            separator = piece_separator
+        if current is not None:
+            segments.append((current, ''))
         
-        return segments
\ No newline at end of file
+        return segments
@@ -0,0 +1,284 @@
+import sys
+import json
+import time
+import tempfile
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, 'src')
+from text_corrector import TextCorrector, PROMPTS
+
+logging.basicConfig(level=logging.INFO)
+
+class FakeArkHandler(BaseHTTPRequestHandler):
+    """本地模拟的Ark对话接口：把“夭”改为“天”后原样返回（修改列表模式下只返回修改项，可疑片段模式下返回修正后的【】内文字），
+    并记录同时处理的请求数"""
+
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    request_times = []
+    failed_once = set()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        mode = next(name for name, (system_prompt, _) in PROMPTS.items() if system_prompt == body['messages'][0]['content'])
+        text = body['messages'][-1]['content'][len(PROMPTS[mode][1].format(text='')):]
+
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+            cls.request_times.append(time.monotonic())
+            # 包含“重试”的段落第一次请求返回服务端错误
+            fail = '重试' in text and text not in cls.failed_once
+            if fail:
+                cls.failed_once.add(text)
+        try:
+            time.sleep(0.2)
+            if fail:
+                self._send(500, {'error': {'message': 'temporary failure', 'code': 'InternalServiceError'}})
+                return
+            # 每个字符按一个令牌计，超过 max_tokens 的输出被截断
+            content = text.replace('夭', '天')
+            if mode == 'windows':
+                fixes = {}
+                for line in text.split('\n'):
+                    number, window = line.split('. ', 1)
+                    span = window[window.index('【') + 1:window.index('】')]
+                    if '夭' in span:
+                        fixes[number] = span.replace('夭', '天')
+                content = json.dumps(fixes, ensure_ascii=False)
+            if mode == 'edits':
+                edits = [{'old': '夭', 'new': '天', 'before': text[max(0, i - 4):i]} for i, ch in enumerate(text) if ch == '夭']
+                # 包含“无法定位”的段落返回原文中不存在的修改项
+                if '无法定位' in text:
+                    edits.append({'old': '不存在的片段', 'new': '片段'})
+                content = json.dumps(edits, ensure_ascii=False)
+            finish_reason = 'stop'
+            if len(content) > body['max_tokens']:
+                content, finish_reason = content[:body['max_tokens']], 'length'
+            self._send(200, {
+                'id': 'chatcmpl-local',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': body['model'],
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': content},
+                    'finish_reason': finish_reason
+                }],
+                'usage': {'prompt_tokens': len(text) + 50, 'completion_tokens': len(content), 'total_tokens': len(text) + len(content) + 50}
+            })
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeArkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def make_corrector(server, **options):
+    settings = {
+        'model_name': 'doubao-pro-128k',
+        'base_url': f"http://127.0.0.1:{server.server_address[1]}/api/v3",
+        'ark_api_key': 'local-test',
+        'max_segment_tokens': 20,
+        'max_retries': 2,
+        'retry_delay': 0.1,
+        'cache': {'enable': False},
+    }
+    settings.update(options)
+    return TextCorrector({'text_correction': settings})
+
+def test_async_correction():
+    server = start_server()
+    corrector = make_corrector(server, concurrency=4, requests_per_second=0)
+
+    # 每行单独成段，校正结果必须按原顺序拼接
+    lines = [f"第{i}行：我今夭要去图书馆看书。" for i in range(12)]
+    start_time = time.perf_counter()
+    corrected = corrector.correct_text('\n'.join(lines))
+    elapsed = time.perf_counter() - start_time
+
+    assert corrected == '\n'.join(line.replace('夭', '天') for line in lines), corrected
+    assert FakeArkHandler.max_in_flight <= 4, FakeArkHandler.max_in_flight
+    # 12个请求、每个0.2秒、并发4，串行需要2.4秒
+    assert elapsed < 1.5, elapsed
+    print(f"并发校正: {len(lines)} 段, 耗时 {elapsed:.2f}s, 最大并发 {FakeArkHandler.max_in_flight}")
+
+    # 多线程（流水线中的校正线程）同时调用时共享同一并发上限
+    FakeArkHandler.max_in_flight = 0
+    pages = [[f"第{page}页第{i}行：夭" for i in range(3)] for page in range(6)]
+    results = [None] * len(pages)
+
+    def correct_page(index):
+        results[index] = corrector.correct_text('\n'.join(pages[index]))
+
+    threads = [threading.Thread(target=correct_page, args=(i,)) for i in range(len(pages))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['\n'.join(line.replace('夭', '天') for line in page) for page in pages]
+    assert FakeArkHandler.max_in_flight <= 4, FakeArkHandler.max_in_flight
+    corrector.close()
+    server.shutdown()
+
+def test_rate_limit():
+    server = start_server()
+    corrector = make_corrector(server, concurrency=16, requests_per_second=10)
+    FakeArkHandler.request_times = []
+
+    texts = [f"第{i}段：夭" for i in range(20)]
+    corrected = corrector.correct_texts(texts)
+
+    assert corrected == [text.replace('夭', '天') for text in texts]
+    # 令牌桶容量为10：前10个请求立即发出，其余按每秒10个放行，最后一个约在1秒后发出；
+    # 时间记录在服务端，第一个请求的网络和调度延迟会压缩间隔，下限留出余量
+    span = FakeArkHandler.request_times[-1] - FakeArkHandler.request_times[0]
+    assert span >= 0.8, span
+    print(f"限速: {len(texts)} 个请求分布在 {span:.2f}s 内")
+    corrector.close()
+    server.shutdown()
+
+def test_retry():
+    server = start_server()
+    corrector = make_corrector(server, concurrency=2, requests_per_second=0)
+
+    corrected = corrector.correct_text("需要重试的段落：夭")
+
+    assert corrected == "需要重试的段落：天", corrected
+    assert corrector.stats['retries'] == 1, corrector.stats
+    print(f"重试: {corrector.stats}")
+    corrector.close()
+    server.shutdown()
+
+def test_cache():
+    server = start_server()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = {'enable': True, 'path': f"{cache_dir}/correction_cache.sqlite"}
+        text = "缓存测试第一段落的内容：夭\n缓存测试第二段落的内容：夭"
+
+        corrector = make_corrector(server, concurrency=2, requests_per_second=0, cache=cache)
+        first = corrector.correct_text(text)
+        corrector.close()
+
+        # 新的校正器（相当于重新运行）直接从缓存得到结果，不再请求接口
+        FakeArkHandler.request_times = []
+        corrector = make_corrector(server, concurrency=2, requests_per_second=0, cache=cache)
+        second = corrector.correct_text(text)
+        counters = corrector.cache.counters()
+        corrector.close()
+
+    assert first == second == text.replace('夭', '天'), second
+    assert FakeArkHandler.request_times == [], FakeArkHandler.request_times
+    assert counters['hits'] == 2 and counters['hit_rate'] == 1.0, counters
+    assert counters['saved_completion_tokens'] > 0, counters
+    print(f"缓存: {counters}")
+    server.shutdown()
+
+def test_confidence_windows():
+    server = start_server()
+    corrector = make_corrector(server, concurrency=2, requests_per_second=0, max_segment_tokens=200)
+    FakeArkHandler.request_times = []
+
+    # 第二、四行的“夭下”置信度低，两处片段编号后在同一个请求中校正；
+    # 上下文中的“夭”置信度高，即使模型会改动也不替换
+    page = {
+        'text': "第一行内容都很清楚\n这里有错字夭下太平\n第三行同样清楚\n夭气好，夭下无事",
+        'text_source': 'ocr',
+        'ocr_lines': [
+            [["第一行内容都很清楚", 95.0]],
+            [["这里有错字", 93.0], ["夭下", 41.5], ["太平", 90.0]],
+            [["第三行同样清楚", 96.0]],
+            [["夭气好，", 91.0], ["夭下", 45.0], ["无事", 92.0]],
+        ]
+    }
+    corrected = corrector.correct_page(page)
+    assert corrected == "第一行内容都很清楚\n这里有错字天下太平\n第三行同样清楚\n夭气好，天下无事", corrected
+    assert len(FakeArkHandler.request_times) == 1, FakeArkHandler.request_times
+    assert corrector.stats['edits'] == 2, corrector.stats
+    # 送入的字符包括提示词
+    system_prompt, user_prompt = PROMPTS['windows']
+    assert corrector.stats['chars_sent'] > len(system_prompt) + len(user_prompt), corrector.stats
+
+    # 置信度都高的页面和文本层页面不调用接口
+    clear_page = dict(page, ocr_lines=[[["第一行内容都很清楚", 95.0]], [["这里有错字夭下太平", 92.0]], [["第三行同样清楚", 96.0]]])
+    assert corrector.correct_page(clear_page) == page['text']
+    assert corrector.correct_page(dict(page, text_source='layer')) == page['text']
+    assert len(FakeArkHandler.request_times) == 1, FakeArkHandler.request_times
+    assert corrector.stats['pages_skipped'] == 2, corrector.stats
+    print(f"置信度校正: {corrector.stats}")
+    corrector.close()
+    server.shutdown()
+
+def test_segment_tokens():
+    server = start_server()
+    corrector = make_corrector(server, concurrency=4, requests_per_second=0)
+
+    # 没有换行的长段落在句末切分，拼接时不插入多余的换行
+    paragraph = "".join(f"第{i}句说的是夭气。" for i in range(8))
+    segments = corrector._split_text(paragraph + "\n短行")
+    assert ''.join(segment + separator for segment, separator in segments) == paragraph + "\n短行"
+    assert all(segment.endswith('。') for segment, _ in segments[:-2]), segments
+    assert corrector.correct_text(paragraph) == paragraph.replace('夭', '天')
+
+    # 片段超过输出上限时被截断，只把该片段拆开重试
+    corrector = make_corrector(server, concurrency=4, requests_per_second=0, max_output_tokens=20, max_segment_tokens=40)
+    text = "一二三四五六七八九十，天地玄黄夭宇宙洪荒。日月盈昃辰宿列张，寒来暑往秋收冬藏。"
+    corrected = corrector.correct_text(text)
+    assert corrected == text.replace('夭', '天'), corrected
+    assert corrector.stats['truncated'] == 1, corrector.stats
+    print(f"按令牌分段: {len(segments)} 段, {corrector.stats}")
+    corrector.close()
+    server.shutdown()
+
+def test_edit_mode():
+    server = start_server()
+    # 多数行没有错误，修改列表只包含出错的片段
+    text = '\n'.join(
+        f"第{i}行：{'今夭' if i % 3 == 0 else '今天'}的天气很好，我们一起去公园散步，顺便看看湖边新开的花，傍晚再回家吃饭。"
+        for i in range(9)
+    )
+
+    full = make_corrector(server, concurrency=4, requests_per_second=0, max_segment_tokens=200)
+    expected = full.correct_text(text)
+    edits = make_corrector(server, concurrency=4, requests_per_second=0, max_segment_tokens=200, mode='edits')
+    corrected = edits.correct_text(text)
+
+    assert corrected == expected == text.replace('夭', '天'), corrected
+    assert edits.stats['edits'] == 3 and edits.stats['edit_fallbacks'] == 0, edits.stats
+    # 修改列表比全文短得多
+    assert edits.stats['completion_tokens'] < full.stats['completion_tokens'] / 2, (edits.stats, full.stats)
+    print(f"修改列表: 输出 {edits.stats['completion_tokens']} / 全文 {full.stats['completion_tokens']} 个令牌")
+
+    # 修改项无法应用时改为全文校正
+    corrected = edits.correct_text("这一段无法定位：夭")
+    assert corrected == "这一段无法定位：天", corrected
+    assert edits.stats['edit_fallbacks'] == 1, edits.stats
+    full.close()
+    edits.close()
+    server.shutdown()
+
+if __name__ == "__main__":
+    test_async_correction()
+    test_rate_limit()
+    test_retry()
+    test_cache()
+    test_confidence_windows()
+    test_segment_tokens()
+    test_edit_mode()
@@ -0,0 +1,138 @@
+import sys
+import tempfile
+import logging
+from pathlib import Path
+
+sys.path.insert(0, 'src')
+from checkpoint import CheckpointStore
+from main import STAGES, iter_ocr_pages, strip_boilerplate, restore_page, checkpointed
+from text_cleaner import TextCleaner
+
+logging.basicConfig(level=logging.INFO)
+
+class FakePDFProcessor:
+    """模拟的PDF处理器：记录实际渲染和识别的页码"""
+
+    def __init__(self, page_count, images=0):
+        self.page_count = page_count
+        self.images = images
+        self.rendered = []
+
+    def get_page_count(self, pdf_path):
+        return self.page_count
+
+    def iter_pages(self, pdf_path, skip_pages=None, image_dir=None):
+        for page_number in range(1, self.page_count + 1):
+            if page_number in (skip_pages or set()):
+                continue
+            yield self.rasterize_and_process(pdf_path, page_number, image_dir)
+
+    def rasterize_and_process(self, pdf_path, page_number, image_dir=None):
+        self.rendered.append(page_number)
+        images = [{'roi': f"第{page_number}页子图{index}"} for index in range(self.images)]
+        return {'page_number': page_number, 'text': f"第{page_number}页重新识别", 'images': images}
+
+    def wait_for_image_writes(self, page_number=None):
+        pass
+
+def test_resume_missing_and_corrupt():
+    with tempfile.TemporaryDirectory() as run_dir:
+        checkpoints = CheckpointStore(run_dir, STAGES)
+        for page_number in (1, 2, 3):
+            checkpoints.save('ocr', {'page_number': page_number, 'text': f"第{page_number}页检查点", 'images': []})
+        # 第2页的检查点损坏，第4页没有检查点
+        (Path(run_dir) / 'ocr' / 'page_00002.json').write_text('{"page_number": 2, "te', encoding='utf-8')
+
+        checkpoints = CheckpointStore(run_dir, STAGES, resume=True)
+        pdf_processor = FakePDFProcessor(4)
+        pages = list(iter_ocr_pages(pdf_processor, 'book.pdf', STAGES, checkpoints))
+
+    assert [page['page_number'] for page in pages] == [1, 2, 3, 4], pages
+    assert [page['text'] for page in pages] == ["第1页检查点", "第2页重新识别", "第3页检查点", "第4页重新识别"], pages
+    assert pdf_processor.rendered == [2, 4], pdf_processor.rendered
+    assert checkpoints.reused == {'ocr': 2}, checkpoints.reused
+    print(f"恢复: 复用 {checkpoints.reused}, 重新识别 {pdf_processor.rendered}")
+
+def test_fresh_run_keeps_other_files():
+    with tempfile.TemporaryDirectory() as run_dir:
+        checkpoints = CheckpointStore(run_dir, STAGES)
+        checkpoints.save('ocr', {'page_number': 1, 'text': "旧结果", 'images': []})
+        checkpoints.save_report({'pages': 1})
+        (Path(run_dir) / 'correction_cache.sqlite').write_bytes(b'cache')
+
+        # 不带 --resume 重新运行只清空检查点和报告
+        CheckpointStore(run_dir, STAGES)
+        assert not (Path(run_dir) / 'ocr').exists()
+        assert not (Path(run_dir) / 'report.json').exists()
+        assert (Path(run_dir) / 'correction_cache.sqlite').read_bytes() == b'cache'
+
+def test_boilerplate_skips_restored_pages():
+    cleaner = TextCleaner({'text_correction': {}, 'text_cleaning': {'boilerplate': {'min_pages': 3}}})
+    header = "梅花易数白话解"
+    pages = [{'page_number': n, 'text': f"{header}\n第{n}页正文内容各不相同{n * 7}\n第{n}页第二行\n第{n}页第三行\n第{n}页第四行"} for n in range(1, 7)]
+    # 第1、2页从校正阶段的检查点恢复，页眉已经删除过，文本不应再被修改
+    for page in pages:
+        page['stages'] = ['ocr']
+    for page in pages[:2]:
+        page['text'] = f"第{page['page_number']}页校正后的正文"
+        page['stages'] = ['ocr', 'clean', 'correct']
+
+    result = strip_boilerplate(pages, cleaner)
+
+    assert [page['page_number'] for page in result] == [1, 2, 3, 4, 5, 6]
+    assert [page['text'] for page in result[:2]] == ["第1页校正后的正文", "第2页校正后的正文"]
+    assert all(header not in page['text'] for page in result[2:]), result
+    assert cleaner.boilerplate_stats['pages'] == 4, cleaner.boilerplate_stats
+
+def test_resume_runs_skipped_stages():
+    with tempfile.TemporaryDirectory() as run_dir:
+        # 第一次只执行 ocr,clean,correct
+        checkpoints = CheckpointStore(run_dir, STAGES)
+        first = ['ocr', 'clean', 'correct']
+        page = {'page_number': 1, 'text': "原文", 'images': [], 'stages': ['ocr']}
+        for name in first[1:]:
+            page = checkpointed(name, lambda page: dict(page, text=page['text'] + name), checkpoints)(page)
+
+        # 以全部阶段恢复：卦象阶段没有执行过，不能因为排在校正之前而被跳过
+        checkpoints = CheckpointStore(run_dir, STAGES, resume=True)
+        page = restore_page(1, STAGES, checkpoints)
+        ran = []
+        for name in STAGES[1:]:
+            page = checkpointed(name, lambda page, name=name: ran.append(name) or page, checkpoints)(page)
+        assert ran == ['hexagram', 'caption'], ran
+        assert page['text'] == "原文cleancorrect"
+
+        # 再次恢复时读取最后写入的检查点，所有阶段都已完成
+        checkpoints = CheckpointStore(run_dir, STAGES, resume=True)
+        page = restore_page(1, STAGES, checkpoints)
+        assert sorted(page['stages']) == sorted(STAGES), page['stages']
+
+def test_resume_without_saved_images():
+    with tempfile.TemporaryDirectory() as run_dir:
+        # save_images 为 false 时检查点中的子图既没有ROI也没有文件路径
+        checkpoints = CheckpointStore(run_dir, STAGES)
+        for page_number in (1, 2):
+            checkpoints.save('clean', {
+                'page_number': page_number, 'text': f"第{page_number}页清理后", 'stages': ['ocr', 'hexagram', 'clean'],
+                'images': [{'position': {'x': 0}, 'analysis': "卦象"}] if page_number == 1 else []
+            })
+
+        # 还要执行描述阶段：第1页重新渲染补回子图，沿用检查点中的文本；第2页没有子图，不用重新渲染
+        pdf_processor = FakePDFProcessor(2, images=1)
+        pages = list(iter_ocr_pages(pdf_processor, 'book.pdf', STAGES, CheckpointStore(run_dir, STAGES, resume=True)))
+        assert pdf_processor.rendered == [1], pdf_processor.rendered
+        assert pages[0]['text'] == "第1页清理后"
+        assert pages[0]['images'] == [{'position': {'x': 0}, 'analysis': "卦象", 'roi': "第1页子图0"}], pages[0]
+
+        # 不执行卦象和描述阶段时不需要子图
+        pdf_processor = FakePDFProcessor(2, images=1)
+        stages = ['ocr', 'clean', 'correct']
+        list(iter_ocr_pages(pdf_processor, 'book.pdf', stages, CheckpointStore(run_dir, STAGES, resume=True)))
+        assert pdf_processor.rendered == [], pdf_processor.rendered
+
+if __name__ == "__main__":
+    test_resume_missing_and_corrupt()
+    test_fresh_run_keeps_other_files()
+    test_boilerplate_skips_restored_pages()
+    test_resume_runs_skipped_stages()
+    test_resume_without_saved_images()
@@ -1,7 +1,11 @@
+import sys
 import yaml
-from src.text_corrector import TextCorrector
 import logging
 
+# text_corrector 以同目录模块的方式导入 rate_limiter 等依赖
+sys.path.insert(0, 'src')
+from text_corrector import TextCorrector
+
 logging.basicConfig(level=logging.INFO)
 
 def test_correction():
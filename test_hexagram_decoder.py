@@ -0,0 +1,69 @@
+import sys
+import random
+import string
+import itertools
+import cv2
+import numpy as np
+
+sys.path.insert(0, 'src')
+from hexagram_decoder import decode_hexagram
+
+def hexagram_crop(lines, rng, frame=False):
+    """绘制接近扫描效果的卦象子图：lines自下而上，1为阳爻，0为阴爻；带模糊和噪点，可带外框"""
+    size = rng.randint(140, 260)
+    image = np.full((size, size), 255, np.uint8)
+    margin = int(size * rng.uniform(0.12, 0.2))
+    top = int(size * rng.uniform(0.1, 0.18))
+    pitch = (size - 2 * top) / len(lines)
+    thickness = max(3, int(pitch * rng.uniform(0.35, 0.6)))
+    gap = int((size - 2 * margin) * rng.uniform(0.12, 0.22))
+    for index, yang in enumerate(reversed(lines)):
+        y = int(top + index * pitch + (pitch - thickness) / 2)
+        image[y:y + thickness, margin:size - margin] = 0
+        if not yang:
+            image[y:y + thickness, size // 2 - gap // 2:size // 2 + gap // 2] = 255
+    if frame:
+        cv2.rectangle(image, (2, 2), (size - 3, size - 3), 0, 2)
+    image = cv2.GaussianBlur(image, (3, 3), 0)
+    noise = np.random.default_rng(rng.randint(0, 10 ** 6)).normal(0, 12, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+def text_crop(rng, line_count, lowercase=False):
+    """绘制3行或6行文字组成的方形文字块"""
+    size = rng.randint(140, 260)
+    image = np.full((size, size), 255, np.uint8)
+    pitch = size / (line_count + 1)
+    chars = string.ascii_lowercase if lowercase else string.ascii_letters + string.digits + '=-_#'
+    for index in range(line_count):
+        text = ''.join(rng.choice(chars) for _ in range(rng.randint(6, 14)))
+        font = rng.choice([0, 1, 2, 3, 4, 6, 7])
+        origin = (rng.randint(3, 15), int(pitch * (index + 1)))
+        cv2.putText(image, text, origin, font, rng.uniform(0.5, 1.0), 0, rng.randint(1, 3))
+    return image
+
+def test_decode_hexagram_crops():
+    rng = random.Random(1)
+    for lines in itertools.product([1, 0], repeat=6):
+        for frame in (False, True):
+            decoded = decode_hexagram(hexagram_crop(list(lines), rng, frame))
+            assert decoded is not None and decoded['lines'] == list(lines), (lines, frame, decoded)
+    for lines in itertools.product([1, 0], repeat=3):
+        decoded = decode_hexagram(hexagram_crop(list(lines), rng))
+        assert decoded is not None and decoded['kind'] == 'trigram' and decoded['lines'] == list(lines)
+
+    qian = decode_hexagram(hexagram_crop([1] * 6, rng))
+    assert qian['number'] == 1 and qian['name'] == '乾'
+
+def test_reject_text_blocks():
+    # 文字块的行投影同样会形成3条或6条水平带，但不是实心爻线，不能解码为卦象
+    rng = random.Random(2)
+    for lowercase in (False, True):
+        accepted = [
+            decoded for decoded in (decode_hexagram(text_crop(rng, rng.choice([3, 6]), lowercase)) for _ in range(200))
+            if decoded is not None
+        ]
+        assert not accepted, accepted[:3]
+
+if __name__ == "__main__":
+    test_decode_hexagram_crops()
+    test_reject_text_blocks()
@@ -0,0 +1,74 @@
+import sys
+import random
+import tempfile
+import itertools
+from pathlib import Path
+import cv2
+import numpy as np
+
+sys.path.insert(0, 'src')
+from phash_index import PerceptualHashIndex, hamming_distance
+
+def render_hexagram(lines, size=200):
+    """绘制六爻卦象图：1为阳爻（实线），0为阴爻（中间断开）"""
+    image = np.full((size, size), 255, np.uint8)
+    for index, yang in enumerate(lines):
+        top = 25 + index * 27
+        image[top:top + 14, 30:170] = 0
+        if not yang:
+            image[top:top + 14, 88:112] = 255
+    return cv2.GaussianBlur(image, (3, 3), 0)
+
+def render_taiji(size=200):
+    """绘制太极图，作为与卦象不同的图形"""
+    image = np.full((size, size), 255, np.uint8)
+    cv2.circle(image, (size // 2, size // 2), 80, 0, 3)
+    cv2.ellipse(image, (size // 2, size // 2 - 40), (40, 40), 0, 90, 270, 0, -1)
+    cv2.circle(image, (size // 2, size // 2 + 40), 10, 0, -1)
+    return image
+
+def rescan(image, rng):
+    """模拟同一图形在另一页重新扫描：子图按轮廓外接矩形裁剪、DPI相同，只有约1%的缩放、1像素的平移和噪点"""
+    size = int(image.shape[0] * rng.uniform(0.99, 1.01))
+    image = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+    shift = np.float32([[1, 0, rng.randint(-1, 1)], [0, 1, rng.randint(-1, 1)]])
+    image = cv2.warpAffine(image, shift, (size, size), borderValue=255)
+    noise = np.random.default_rng(rng.randint(0, 10 ** 6)).normal(0, 12, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+def test_rescanned_figures_merged():
+    index = PerceptualHashIndex()
+    rng = random.Random(0)
+    figures = {'taiji': render_taiji()}
+    figures.update((''.join(map(str, lines)), render_hexagram(lines)) for lines in itertools.product([1, 0], repeat=6))
+
+    # 同一图形重新扫描后的距离不超过阈值，空白区域的噪点不再使哈希位随机翻转
+    distances = [
+        hamming_distance(index.hash(image), index.hash(rescan(image, rng)))
+        for image in figures.values() for _ in range(5)
+    ]
+    assert max(distances) <= index.max_distance, sorted(distances)[-10:]
+
+    # 与卦象外形不同的图形不会合并
+    index.add(index.hash(figures['taiji']), 'taiji')
+    assert index.lookup(index.hash(rescan(figures['taiji'], rng))) == 'taiji'
+    assert all(index.lookup(index.hash(image)) is None for name, image in figures.items() if name != 'taiji')
+
+def test_index_saved_only_when_dirty():
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'phash.json'
+        index = PerceptualHashIndex(index_path=path, namespace='blip')
+        index.save()
+        assert not path.exists()
+
+        index.add(index.hash(render_taiji()), 'taiji')
+        index.save()
+        reloaded = PerceptualHashIndex(index_path=path, namespace='blip')
+        assert reloaded.lookup(reloaded.hash(render_taiji())) == 'taiji'
+
+        # 哈希参数不同时不复用已有条目
+        assert PerceptualHashIndex(index_path=path, namespace='blip', tolerance=0).entries == []
+
+if __name__ == "__main__":
+    test_rescanned_figures_merged()
+    test_index_saved_only_when_dirty()
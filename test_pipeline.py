@@ -0,0 +1,86 @@
+import sys
+import time
+import threading
+
+sys.path.insert(0, 'src')
+from pipeline import PipelineExecutor, PipelineStage
+
+def test_pipeline_order():
+    def slow_double(value):
+        time.sleep(0.01 * (value % 3))
+        return value * 2
+
+    executor = PipelineExecutor([
+        PipelineStage('double', slow_double, workers=3),
+        PipelineStage('batch', lambda values: [value + 1 for value in values], workers=2, batch_size=4),
+    ], queue_size=2)
+    assert list(executor.run(range(20))) == [value * 2 + 1 for value in range(20)]
+
+def test_threads_exit_after_failure():
+    def fail_on_five(value):
+        if value == 5:
+            raise ValueError("第5项处理失败")
+        return value
+
+    executor = PipelineExecutor([
+        PipelineStage('check', fail_on_five, workers=3),
+        PipelineStage('slow', lambda value: time.sleep(0.01) or value, workers=2),
+    ], queue_size=1)
+    results = []
+    try:
+        for value in executor.run(range(100)):
+            results.append(value)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("阶段失败没有抛出异常")
+    assert results == [0, 1, 2, 3, 4], results
+
+    # 出错停止后所有工作线程都应退出，不能阻塞在已满的队列上
+    deadline = time.monotonic() + 2
+    while time.monotonic() < deadline:
+        alive = [thread.name for thread in threading.enumerate() if thread.name.startswith('pipeline-')]
+        if not alive:
+            break
+        time.sleep(0.05)
+    assert not alive, alive
+
+def test_batch_fill_across_pages():
+    # 上游每20毫秒产出一页、每页2张图片，描述阶段应跨页凑满8张图片再推理
+    def slow_source():
+        for page in range(12):
+            time.sleep(0.02)
+            yield {'page': page, 'images': 2}
+
+    batch_images = []
+
+    def caption(pages):
+        batch_images.append(sum(page['images'] for page in pages))
+        return pages
+
+    executor = PipelineExecutor([
+        PipelineStage('caption', caption, batch_size=8, batch_timeout=1.0, batch_weight=lambda page: page['images']),
+    ], queue_size=4)
+    results = list(executor.run(slow_source()))
+
+    assert [page['page'] for page in results] == list(range(12))
+    assert batch_images == [8, 8, 8], batch_images
+
+    # 超时后不再等待，上游很慢时按已收到的页面推理
+    batch_images.clear()
+    executor = PipelineExecutor([
+        PipelineStage('caption', caption, batch_size=8, batch_timeout=0.05, batch_weight=lambda page: page['images']),
+    ], queue_size=4)
+
+    def slower_source():
+        for page in range(3):
+            time.sleep(0.2)
+            yield {'page': page, 'images': 2}
+
+    assert len(list(executor.run(slower_source()))) == 3
+    assert batch_images == [2, 2, 2], batch_images
+
+if __name__ == "__main__":
+    test_pipeline_order()
+    test_threads_exit_after_failure()
+    test_batch_fill_across_pages()
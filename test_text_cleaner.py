@@ -0,0 +1,53 @@
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, 'src')
+from text_cleaner import TextCleaner, iter_decoded_chunks, clean_file
+
+def test_short_pages_keep_content():
+    cleaner = TextCleaner({'text_correction': {}, 'text_cleaning': {'boilerplate': {'min_pages': 3}}})
+    header = "梅花易数白话解"
+    pages = [
+        {'page_number': n, 'text': f"{header}\n第{n}页正文内容各不相同{n * 7}\n第{n}页第二行{n * 3}\n第{n}页第三行\n第{n}页页尾{n}"}
+        for n in range(1, 7)
+    ]
+    # 第7、8页只有几行重复出现的短文本（如卦辞），所有行都在首尾，不能被当作页眉页脚整页删除
+    short = "乾：元亨利贞\n初九：潜龙勿用"
+    pages += [{'page_number': 7, 'text': short}, {'page_number': 8, 'text': short}, {'page_number': 9, 'text': short}]
+
+    cleaner.remove_boilerplate(pages)
+
+    assert all(header not in page['text'] for page in pages[:6]), pages
+    assert [page['text'] for page in pages[6:]] == [short] * 3, pages[6:]
+
+def test_decoded_chunks():
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'book.txt'
+
+        # 只用 \r 换行的文件同样按行切分，不会整个积压到最后
+        path.write_bytes('\r'.join(f"第{i}行" for i in range(200)).encode('gb18030'))
+        chunks = list(iter_decoded_chunks(str(path), 'gb18030', chunk_size=64))
+        assert ''.join(chunks) == '\r'.join(f"第{i}行" for i in range(200))
+        assert len(chunks) > 10 and all(len(chunk) <= 2 * 64 for chunk in chunks), [len(chunk) for chunk in chunks]
+
+        # 没有换行的超长行按块产出，写出时直接续接
+        text = "乾为天" * 1000
+        path.write_bytes(text.encode('utf-8'))
+        chunks = list(iter_decoded_chunks(str(path), 'utf-8', chunk_size=256))
+        assert ''.join(chunks) == text and max(len(chunk) for chunk in chunks) <= 2 * 256
+        cleaner = TextCleaner({'text_correction': {}})
+        output = Path(directory) / 'out.txt'
+        assert clean_file(cleaner, str(path), str(output), 'utf-8', chunk_size=256) == len(text)
+        assert output.read_text(encoding='utf-8') == text
+
+        # 无法解码的字节替换为U+FFFD并计数
+        path.write_bytes("第一行\n".encode('utf-8') + b'\xff\xfe' + "第二行\n".encode('utf-8'))
+        stats = {}
+        chunks = list(iter_decoded_chunks(str(path), 'utf-8', stats=stats))
+        assert ''.join(chunks) == "第一行\n\ufffd\ufffd第二行\n", chunks
+        assert stats == {'replaced_bytes': 2}, stats
+
+if __name__ == "__main__":
+    test_short_pages_keep_content()
+    test_decoded_chunks()